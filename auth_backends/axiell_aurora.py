@@ -14,7 +14,9 @@ from social_core.exceptions import AuthMissingParameter
 from social_django.views import complete as complete_view
 
 from tunnistamo import ratelimit, auditlog
+from tunnistamo.circuit_breaker import get_breaker
 from tunnistamo.exceptions import AccountTemporarilyLocked, AuthBackendUnavailable
+from tunnistamo.http_client import get_session
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +42,8 @@ class AuroraLoginForm(forms.Form):
 
 class AuroraAuth(LegacyAuth):
     name = 'axiell_aurora'
+    # Name of the upstream service in HTTP_CLIENTS and CIRCUIT_BREAKERS
+    upstream = 'axiell_aurora'
     ID_KEY = 'borrower_card_id'
     PIN_KEY = 'borrower_pin'
     FORM_HTML = 'axiell_aurora/login.html'
@@ -53,7 +57,7 @@ class AuroraAuth(LegacyAuth):
     def api_post(self, path, **kwargs):
         url = '%s/API/%s' % (self.setting('API_URL'), path)
         try:
-            resp = requests.post(url, **kwargs)
+            resp = get_session(self.upstream).post(url, **kwargs)
             resp.raise_for_status()
         except requests.exceptions.RequestException as err:
             logger.exception('API call to %s failed' % path, exc_info=err)
@@ -98,6 +102,10 @@ class AuroraAuth(LegacyAuth):
         if request.method == 'POST':
             form = AuroraLoginForm(request.POST)
             if form.is_valid():
+                # Fail fast while the upstream service is known to be down. A
+                # probe of a half-open circuit is taken only by the API request.
+                if not get_breaker(self.upstream).is_available():
+                    raise AuthBackendUnavailable()
                 try:
                     borrower_info = self.get_borrower_info(form.cleaned_data)
                     return complete_view(request, self.name, borrower_info=borrower_info)
@@ -16,7 +16,9 @@ from social_core.exceptions import AuthMissingParameter
 from social_django.views import complete as complete_view
 
 from tunnistamo import auditlog, ratelimit
+from tunnistamo.circuit_breaker import get_breaker
 from tunnistamo.exceptions import AccountTemporarilyLocked, AuthBackendUnavailable
+from tunnistamo.http_client import get_session
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +41,8 @@ class FoliLoginForm(forms.Form):
 
 class FoliAuth(LegacyAuth):
     name = 'foli'
+    # Name of the upstream service in HTTP_CLIENTS and CIRCUIT_BREAKERS
+    upstream = 'foli'
     ID_KEY = 'username'
     PIN_KEY = 'password'
     FORM_HTML = 'foli/login.html'
@@ -52,7 +56,7 @@ class FoliAuth(LegacyAuth):
     def api_request(self, method, path, **kwargs):
         url = '%s%s' % (self.setting('API_URL'), path)
         try:
-            resp = getattr(requests, method)(url, **kwargs)
+            resp = getattr(get_session(self.upstream), method)(url, **kwargs)
             if resp.status_code != 401:
                 resp.raise_for_status()
         except requests.exceptions.RequestException as err:
@@ -88,6 +92,10 @@ class FoliAuth(LegacyAuth):
         if request.method == 'POST':
             form = FoliLoginForm(request.POST)
             if form.is_valid():
+                # Fail fast while the upstream service is known to be down. A
+                # probe of a half-open circuit is taken only by the API request.
+                if not get_breaker(self.upstream).is_available():
+                    raise AuthBackendUnavailable()
                 try:
                     user_info = self.get_user_info(form.cleaned_data)
                     return complete_view(request, self.name, user_info=user_info)
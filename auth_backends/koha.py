@@ -15,10 +15,15 @@ from social_core.exceptions import AuthMissingParameter
 from social_django.views import complete as complete_view
 
 from tunnistamo import auditlog, ratelimit
+from tunnistamo.circuit_breaker import get_breaker
 from tunnistamo.exceptions import AccountTemporarilyLocked, AuthBackendUnavailable
+from tunnistamo.http_client import get_session
+from tunnistamo.service_tokens import ServiceToken
 
 logger = logging.getLogger(__name__)
 
+VALIDATION_PATH = '/contrib/kohasuomi/auth/patrons/validation'
+
 class APIError(Exception):
     pass
 
@@ -39,6 +44,8 @@ class KohaLoginForm(forms.Form):
 
 class KohaAuth(LegacyAuth):
     name = 'koha'
+    # Name of the upstream service in HTTP_CLIENTS and CIRCUIT_BREAKERS
+    upstream = 'koha'
     ID_KEY = 'borrower_card_id'
     PIN_KEY = 'borrower_pin'
     FORM_HTML = 'koha/login.html'
@@ -49,24 +56,60 @@ class KohaAuth(LegacyAuth):
     def uses_redirect(self):
         return False
 
-    def api_request(self, method, path, **kwargs):
+    def api_call(self, method, path, **kwargs):
         url = '%s%s' % (self.setting('API_URL'), path)
 
         try:
-            resp = getattr(requests, method)(url, **kwargs)
+            resp = getattr(get_session(self.upstream), method)(url, **kwargs)
             if resp.status_code != 401:
                 resp.raise_for_status()
         except requests.exceptions.RequestException as err:
             logger.exception('API call to %s failed' % path, exc_info=err)
             raise APIError('API call to %s failed: %s' % (path, str(err)))
+        return resp
 
+    def parse_response(self, resp):
         try:
             ret = resp.json()
-        except TypeError as err:
+        except (TypeError, ValueError) as err:
             logger.exception('API returned invalid data', exc_info=err)
             raise APIError('API returned invalid JSON data: %s' % str(err))
         return ret
 
+    def api_request(self, method, path, **kwargs):
+        return self.parse_response(self.api_call(method, path, **kwargs))
+
+    def get_oauth_token(self):
+        return ServiceToken(
+            'koha_oauth_token:%s' % settings.KOHA_OAUTH_CLIENT_ID, self.fetch_oauth_token, upstream=self.upstream
+        )
+
+    def fetch_oauth_token(self):
+        ret = self.api_request('post', '/oauth/token', data=dict(
+            grant_type="client_credentials",
+            client_id=settings.KOHA_OAUTH_CLIENT_ID,
+            client_secret=settings.KOHA_OAUTH_CLIENT_API_KEY,
+        ))
+        try:
+            return ret['access_token'], int(ret.get('expires_in', 0))
+        except (KeyError, TypeError, ValueError) as err:
+            raise APIError('API returned an invalid token response: %s' % str(err))
+
+    def validate_patron(self, body, oauth_token, token):
+        for attempt in range(2):
+            headers = {
+                'Authorization': 'Bearer {}'.format(token),
+            }
+            resp = self.api_call('post', VALIDATION_PATH, headers=headers, json=body)
+            result = self.parse_response(resp)
+            # Koha responds with 401 both to invalid patron credentials and
+            # to an expired or revoked token. Retry once with a fresh token
+            # in the latter case.
+            if resp.status_code != 401 or result.get('error') == 'Login failed.' or attempt:
+                return result
+            oauth_token.invalidate(token)
+            token = oauth_token.get()
+
     def is_email_needed(self, **kwargs):
         return False
 
@@ -93,6 +136,10 @@ class KohaAuth(LegacyAuth):
         if request.method == 'POST':
             form = KohaLoginForm(request.POST)
             if form.is_valid():
+                # Fail fast while the upstream service is known to be down. A
+                # probe of a half-open circuit is taken only by the API request.
+                if not get_breaker(self.upstream).is_available():
+                    raise AuthBackendUnavailable()
                 try:
                     borrower_info = self.get_borrower_info(form.cleaned_data)
                     return complete_view(request, self.name, borrower_info=borrower_info)
@@ -140,24 +187,20 @@ class KohaAuth(LegacyAuth):
             auditlog.log_authentication_rate_limited(request, self.name, identifier=borrower_card_id)
             raise AccountTemporarilyLocked()
 
-        # Fetch oauth token for sending requests to /auth/patrons/validation endpoint
-        oauth_token = self.api_request('post', '/oauth/token', data=dict(
-            grant_type="client_credentials",
-            client_id=settings.KOHA_OAUTH_CLIENT_ID,
-            client_secret=settings.KOHA_OAUTH_CLIENT_API_KEY,
-            ))
-        headers = {
-            'Authorization': 'Bearer {}'.format(oauth_token['access_token']),
-        }
-
         body = {
             "cardnumber":borrower_card_id,
             "password": borrower_card_pin
         }
-        
+
+        # Get an oauth token for sending requests to /auth/patrons/validation
+        # endpoint. The token is cached, so it is only requested again when
+        # it is about to expire.
+        oauth_token = self.get_oauth_token()
+        token = oauth_token.get()
+
         # Fetch the patron information.
         try:
-            result = self.api_request('post', '/contrib/kohasuomi/auth/patrons/validation', headers=headers, json=body)
+            result = self.validate_patron(body, oauth_token, token)
         except:
             auditlog.log_authentication_failure(request, self.name, identifier=borrower_card_id)
             raise AuthenticationFailed('Patron validation failure.')
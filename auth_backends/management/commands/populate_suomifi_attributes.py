@@ -1,7 +1,7 @@
 from django.core.management.base import BaseCommand
 from ruamel.yaml import YAML
 
-from auth_backends.models import SuomiFiAccessLevel, SuomiFiUserAttribute
+from auth_backends.models import SuomiFiAccessLevel, SuomiFiUserAttribute, suomifi_access_levels
 
 
 class Command(BaseCommand):
@@ -38,3 +38,5 @@ class Command(BaseCommand):
             for attribute in flatten(details['fields']):
                 access_level.attributes.add(SuomiFiUserAttribute.objects.get(friendly_name=attribute['friendly_name']))
             access_level.save()
+
+        suomifi_access_levels.invalidate()
@@ -0,0 +1,47 @@
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from social_core.backends.utils import load_backends
+
+from auth_backends.metadata import MetadataError, load_metadata_backend, render_metadata
+
+
+class Command(BaseCommand):
+    help = 'Render SAML SP metadata documents into the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backends', nargs='*', metavar='backend',
+                            help='Names of the SAML backends. Defaults to all configured SAML backends.')
+        parser.add_argument('--base-url', action='store', dest='base_url', required=True,
+                            help='Public base URL of Tunnistamo, e.g. https://tunnistamo.example.com')
+
+    def handle(self, *args, **options):
+        base_url = urlparse(options['base_url'])
+        if base_url.scheme not in ('http', 'https') or not base_url.hostname:
+            raise CommandError('Invalid base URL: %s' % options['base_url'])
+
+        # The metadata contains absolute URLs, which are built from the request
+        secure = base_url.scheme == 'https'
+        request = RequestFactory().get(
+            '/',
+            secure=secure,
+            SERVER_NAME=base_url.hostname,
+            SERVER_PORT=str(base_url.port or (443 if secure else 80)),
+        )
+        request.session = {}
+
+        backend_names = options['backends'] or list(load_backends(settings.AUTHENTICATION_BACKENDS))
+        for backend_name in backend_names:
+            backend = load_metadata_backend(request, backend_name)
+            if backend is None:
+                if options['backends']:
+                    raise CommandError('%s is not a SAML backend' % backend_name)
+                continue
+
+            try:
+                render_metadata(backend)
+            except MetadataError as err:
+                raise CommandError('Invalid metadata for %s: %s' % (backend_name, err))
+            self.stdout.write('Rendered metadata for %s' % backend_name)
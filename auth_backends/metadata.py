@@ -0,0 +1,83 @@
+"""
+Cached SAML SP metadata documents.
+
+Generating the metadata of a SAML backend is expensive, so the final document
+is kept in the cache. The cache key contains a hash of the SAML configuration
+and the settings used for amending the metadata, so any change to them makes
+the document to be generated again. The documents are kept for a limited time
+only, because python-saml sets them to expire a couple of days after
+generation.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from social_core.exceptions import MissingBackend
+from social_django.utils import load_backend, load_strategy
+
+# Must be shorter than the validity of the generated metadata
+DEFAULT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Backend settings used for amending the metadata in addition to the SAML
+# configuration
+METADATA_SETTINGS = ('UI_INFO', 'UI_LOGO', 'TECHNICAL_CONTACT', 'SUPPORT_CONTACT', 'ENTITY_ATTRIBUTES')
+
+
+class MetadataError(Exception):
+    def __init__(self, errors):
+        super().__init__(', '.join(errors))
+        self.errors = errors
+
+
+def load_metadata_backend(request, backend_name):
+    """Return the backend called `backend_name` if it provides SAML metadata, otherwise None"""
+    complete_url = reverse('social:complete', args=(backend_name,))
+    try:
+        backend = load_backend(load_strategy(request), backend_name, redirect_uri=complete_url)
+    except MissingBackend:
+        return None
+
+    if not hasattr(backend, 'generate_metadata_xml'):
+        return None
+    return backend
+
+
+def get_metadata_cache_key(backend):
+    config = backend.generate_saml_config()
+    amendments = {name: backend.setting(name) for name in METADATA_SETTINGS}
+    data = json.dumps([config, amendments], sort_keys=True, default=str)
+    return 'saml_metadata:%s:%s' % (backend.name, hashlib.sha256(data.encode('utf-8')).hexdigest())
+
+
+def render_metadata(backend, cache_key=None):
+    """Generate the metadata document of `backend` and store it in the cache
+
+    Returns a dict with the metadata XML bytes, its ETag and the time it was
+    generated. Raises MetadataError if the metadata is invalid.
+    """
+    metadata, errors = backend.generate_metadata_xml()
+    if errors:
+        raise MetadataError(errors)
+
+    metadata = force_bytes(metadata)
+    document = {
+        'metadata': metadata,
+        'etag': '"%s"' % hashlib.sha256(metadata).hexdigest(),
+        'last_modified': int(time.time()),
+    }
+    timeout = getattr(settings, 'SAML_METADATA_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT)
+    cache.set(cache_key or get_metadata_cache_key(backend), document, timeout)
+    return document
+
+
+def get_metadata(backend):
+    """Return the metadata document of `backend`, generating it if it isn't cached"""
+    cache_key = get_metadata_cache_key(backend)
+    document = cache.get(cache_key)
+    if document is None:
+        document = render_metadata(backend, cache_key)
+    return document
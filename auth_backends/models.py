@@ -1,5 +1,9 @@
 from django.db import models
+from django.utils import translation
 from parler.models import TranslatableModel, TranslatedFields
+from parler.utils import get_active_language_choices
+
+from tunnistamo.utils import VersionedValue
 
 
 class SuomiFiUserAttribute(models.Model):
@@ -16,3 +20,37 @@ class SuomiFiAccessLevel(TranslatableModel):
     )
     shorthand = models.CharField(max_length=100, unique=True)
     attributes = models.ManyToManyField(SuomiFiUserAttribute)
+
+
+class SuomiFiAccessLevelData:
+    """Read-only copy of a SuomiFiAccessLevel with its translations and attribute names"""
+
+    def __init__(self, level):
+        self.shorthand = level.shorthand
+        self.translations = {
+            t.language_code: (t.name, t.description) for t in level.translations.all()
+        }
+        self.attributes = tuple(attribute.friendly_name for attribute in level.attributes.all())
+
+    def _get_translation(self, index):
+        for language in get_active_language_choices(translation.get_language()):
+            if language in self.translations:
+                return self.translations[language][index]
+        return ''
+
+    @property
+    def name(self):
+        return self._get_translation(0)
+
+    @property
+    def description(self):
+        return self._get_translation(1)
+
+
+def _load_suomifi_access_levels():
+    levels = SuomiFiAccessLevel.objects.prefetch_related('translations', 'attributes')
+    return {level.shorthand: SuomiFiAccessLevelData(level) for level in levels}
+
+
+# Per-process map of access level shorthand -> SuomiFiAccessLevelData
+suomifi_access_levels = VersionedValue('suomifi-access-levels-version', _load_suomifi_access_levels)
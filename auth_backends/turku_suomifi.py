@@ -7,7 +7,6 @@ from importlib import import_module
 from urllib.parse import urlencode
 from datetime import datetime, date
 
-import requests
 from django.http import HttpResponse, HttpResponseRedirect
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
@@ -21,6 +20,7 @@ from social_core.exceptions import (
 )
 
 from tunnistamo import auditlog
+from tunnistamo.http_client import get_session
 
 
 session_engine = import_module(settings.SESSION_ENGINE)
@@ -108,7 +108,7 @@ class TurkuSuomiFiAuth(LegacyAuth):
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        resp = requests.post(url, headers=headers, data=msg_body)
+        resp = get_session('turku_suomifi').post(url, headers=headers, data=msg_body)
         return resp
 
     def get_and_store_nonce(self, url, secret):
@@ -1,30 +1,34 @@
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseServerError, Http404
-from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from social_django.utils import load_backend, load_strategy
 from django.views.decorators.csrf import csrf_exempt
 from social_django.views import complete as social_django_complete
-from social_core.exceptions import MissingBackend
 
+from auth_backends.metadata import MetadataError, get_metadata, load_metadata_backend
 
-def saml_metadata_view(request, backend):
-    complete_url = reverse('social:complete', args=(backend,))
-    try:
-        saml_backend = load_backend(
-            load_strategy(request),
-            backend,
-            redirect_uri=complete_url,
-        )
-    except MissingBackend:
-        raise Http404()
 
-    if not hasattr(saml_backend, 'generate_metadata_xml'):
+def saml_metadata_view(request, backend):
+    saml_backend = load_metadata_backend(request, backend)
+    if saml_backend is None:
         raise Http404()
 
-    metadata, errors = saml_backend.generate_metadata_xml()
-    if not errors:
-        return HttpResponse(content=metadata, content_type='text/xml')
-    return HttpResponseServerError(content=', '.join(errors))
+    try:
+        document = get_metadata(saml_backend)
+    except MetadataError as err:
+        return HttpResponseServerError(content=', '.join(err.errors))
+
+    response = get_conditional_response(
+        request,
+        etag=document['etag'],
+        last_modified=document['last_modified'],
+    )
+    if response is None:
+        response = HttpResponse(content=document['metadata'], content_type='text/xml')
+    response['ETag'] = document['etag']
+    response['Last-Modified'] = http_date(document['last_modified'])
+    return response
 
 
 @csrf_exempt
@@ -0,0 +1,9 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Makes the per-process copies of database state reload, since database
+    # changes from previous tests have been rolled back.
+    cache.clear()
@@ -3,7 +3,10 @@ from urllib.parse import urljoin
 
 import requests
 from django.conf import settings
-from django.core.cache import cache
+
+from tunnistamo.circuit_breaker import get_breaker
+from tunnistamo.http_client import get_session
+from tunnistamo.service_tokens import ServiceToken
 
 ACCESS_TOKEN_CACHE_KEY = 'HELMET_API_ACCESS_TOKEN'
 
@@ -25,25 +28,17 @@ class HelmetGeneralException(HelmetException):
 
 
 def validate_patron(identifier, secret):
+    if not get_breaker('helmet').is_available():
+        raise HelmetConnectionException('Helmet API is temporarily unavailable.')
+
     token = _get_token()
     return _validate_patron(identifier, secret, token)
 
 
 def _get_token():
-    access_token = cache.get(ACCESS_TOKEN_CACHE_KEY)
-
-    if not access_token:
-        access_token, expires_in = _get_token_request()
-
-        # use 1 min shorter time for the cache to make sure it is invalidated before the token
-        expires_in = max(expires_in - 60, 0)
-
-        default_timeout = settings.CACHES['default'].get('TIMEOUT', 300)
-        timeout = expires_in if default_timeout is None else min(expires_in, default_timeout)
-
-        cache.set(ACCESS_TOKEN_CACHE_KEY, access_token, timeout)
-
-    return access_token
+    # Only one worker refreshes the token, shortly before it expires. The
+    # others keep using the current token meanwhile.
+    return service_token.get()
 
 
 def _get_token_request():
@@ -52,7 +47,7 @@ def _get_token_request():
     url = _create_api_url('token')
 
     try:
-        response = requests.post(url, auth=(username, password))
+        response = get_session('helmet').post(url, auth=(username, password))
         response.raise_for_status()
     except requests.RequestException as e:
         raise HelmetConnectionException(e)
@@ -68,12 +63,18 @@ def _get_token_request():
     return access_token, expires_in
 
 
+service_token = ServiceToken(ACCESS_TOKEN_CACHE_KEY, _get_token_request, upstream='helmet')
+
+
 def _validate_patron(identifier, secret, token):
     headers = {'Authorization': 'Bearer {}'.format(token)}
     data = {'barcode': identifier, 'pin': secret}
     url = _create_api_url('patrons/validate')
 
-    response = requests.post(url, headers=headers, json=data)
+    try:
+        response = get_session('helmet').post(url, headers=headers, json=data)
+    except requests.RequestException as e:
+        raise HelmetConnectionException(e)
 
     if response.status_code == 204:
         return True
@@ -1,19 +1,23 @@
 import json
 import random
 import time
+from datetime import timedelta
 from unittest import mock
 
 import pytest
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils.timezone import now
 from jwcrypto import jwe, jwk, jws
 from jwcrypto.common import json_encode
 from rest_framework.test import APIClient
 
 from devices.factories import InterfaceDeviceFactory, UserDeviceFactory
+from devices.models import InterfaceDevice, UserDevice
 from identities.factories import UserIdentityFactory
 from identities.helmet_requests import HelmetConnectionException
 from identities.models import UserIdentity
+from tunnistamo.api_common import check_interface_device_secret, get_device_keys
 from users.factories import UserFactory, access_token_factory
 
 User = get_user_model()
@@ -160,6 +164,8 @@ def test_access_token_authentication_wrong_scope(api_client, scopes):
 @pytest.mark.django_db
 def test_interface_device_authentication(interface_device_api_client):
     user_device = interface_device_api_client.user_device
+    UserDevice.objects.filter(id=user_device.id).update(last_used_at=now() - timedelta(hours=1))
+    user_device.refresh_from_db()
     old_last_used_at = user_device.last_used_at
     old_auth_counter = user_device.auth_counter
     nonce = interface_device_api_client.nonce
@@ -174,6 +180,19 @@ def test_interface_device_authentication(interface_device_api_client):
     assert user_device.auth_counter == old_auth_counter + 1
 
 
+@pytest.mark.django_db
+def test_interface_device_authentication_coalesces_last_used_at(interface_device_api_client):
+    user_device = interface_device_api_client.user_device
+    old_last_used_at = user_device.last_used_at
+
+    response = interface_device_api_client.get(list_url)
+    assert response.status_code == 200
+
+    user_device.refresh_from_db()
+    assert user_device.last_used_at == old_last_used_at
+    assert user_device.auth_counter == 1
+
+
 @pytest.mark.django_db
 def test_interface_device_authentication_repeat(interface_device_api_client):
     response = interface_device_api_client.get(list_url)
@@ -191,6 +210,30 @@ def test_interface_device_authentication_wrong_client_secret(interface_device_ap
     assert response.status_code == 401
 
 
+@pytest.mark.django_db
+def test_interface_device_secret_verification_is_cached(interface_device_api_client):
+    interface_device = interface_device_api_client.interface_device
+    raw_secret_key = 'a03f1a9c-9fa2-43c0-83cd-ab4233815669'
+    original_check = InterfaceDevice.check_secret_key
+
+    with mock.patch.object(InterfaceDevice, 'check_secret_key', autospec=True, side_effect=original_check) as check:
+        assert check_interface_device_secret(interface_device, raw_secret_key)
+        assert check_interface_device_secret(interface_device, raw_secret_key)
+        assert not check_interface_device_secret(interface_device, 'bogus123')
+
+    assert check.call_count == 2
+
+
+@pytest.mark.django_db
+def test_device_keys_are_cached_by_fingerprint(interface_device_api_client):
+    user_device = interface_device_api_client.user_device
+    keys = get_device_keys(user_device)
+    assert get_device_keys(user_device) is keys
+
+    user_device.secret_key = json.loads(jwk.JWK.generate(kty='oct', alg='HS256', use='enc').export())
+    assert get_device_keys(user_device)[0] is not keys[0]
+
+
 @pytest.mark.django_db
 @mock.patch('identities.api.validate_patron', return_value=True)
 def test_post_user_identity(validate_patron, user_api_client, post_data):
@@ -1,9 +1,18 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 from unittest import mock
 
 import pytest
+from django.core.cache import cache
 from requests.exceptions import RequestException
 
-from identities.helmet_requests import HelmetConnectionException, HelmetImproperlyConfiguredException, validate_patron
+from identities.helmet_requests import (
+    ACCESS_TOKEN_CACHE_KEY, HelmetConnectionException, HelmetImproperlyConfiguredException, service_token,
+    validate_patron
+)
 
 
 class DummyResponse:
@@ -76,7 +85,7 @@ def test_required_settings(settings, missing_setting):
 
 
 @mock.patch(
-    'identities.helmet_requests.requests.post',
+    'requests.Session.post',
     side_effect=(DummyTokenResponse(), DummyResponse(status_code=204)),
 )
 def test_validate_patron(post):
@@ -97,7 +106,7 @@ def test_validate_patron(post):
 
 
 @mock.patch(
-    'identities.helmet_requests.requests.post',
+    'requests.Session.post',
     side_effect=(DummyTokenResponse(), DummyValidatePatronFailedResponse()),
 )
 def test_validate_patron_invalid_credentials(post):
@@ -106,7 +115,7 @@ def test_validate_patron_invalid_credentials(post):
 
 
 @mock.patch(
-    'identities.helmet_requests.requests.post',
+    'requests.Session.post',
     side_effect=RequestException,
 )
 def test_connection_error(post):
@@ -115,35 +124,156 @@ def test_connection_error(post):
 
 
 @mock.patch(
-    'identities.helmet_requests.requests.post',
-    side_effect=(DummyTokenResponse(), DummyValidatePatronFailedResponse()),
+    'requests.Session.post',
+    side_effect=(DummyTokenResponse(), RequestException),
 )
-@mock.patch('identities.helmet_requests.cache.set')
-def test_validate_patron_token_cache_default_timeout(cache_set, post):
-    validate_patron('1234567', '1234')
-    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', 'test_access_token', 300)
+def test_validate_patron_connection_error(post):
+    with pytest.raises(HelmetConnectionException):
+        validate_patron('1234567', '1234')
 
 
+@mock.patch('tunnistamo.service_tokens.time.time', return_value=1000)
 @mock.patch(
-    'identities.helmet_requests.requests.post',
-    side_effect=(DummyTokenResponse(expires_in=160), DummyValidatePatronFailedResponse()),
+    'requests.Session.post',
+    side_effect=(DummyTokenResponse(), DummyValidatePatronFailedResponse()),
 )
-@mock.patch('identities.helmet_requests.cache.set')
-def test_validate_patron_token_cache_timeout_from_token(cache_set, post):
+@mock.patch('tunnistamo.service_tokens.cache.set')
+def test_validate_patron_token_is_cached_for_its_lifetime(cache_set, post, time):
     validate_patron('1234567', '1234')
-    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', 'test_access_token', 100)
+    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', {
+        'token': 'test_access_token',
+        'expires_at': 4600,
+        'refresh_at': 4540,
+    }, 3600)
 
 
+@mock.patch('tunnistamo.service_tokens.time.time', return_value=1000)
 @mock.patch(
-    'identities.helmet_requests.requests.post',
-    side_effect=(DummyTokenResponse(), DummyValidatePatronFailedResponse()) * 2,
+    'requests.Session.post',
+    side_effect=(DummyTokenResponse(expires_in=100), DummyValidatePatronFailedResponse()),
 )
-@mock.patch('identities.helmet_requests.cache.set')
-def test_validate_patron_token_cache_timeout_in_settings(cache_set, post, settings):
-    settings.CACHES['default']['TIMEOUT'] = 100000
+@mock.patch('tunnistamo.service_tokens.cache.set')
+def test_validate_patron_short_lived_token_is_refreshed_halfway(cache_set, post, time):
     validate_patron('1234567', '1234')
-    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', 'test_access_token', 3540)
+    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', {
+        'token': 'test_access_token',
+        'expires_at': 1100,
+        'refresh_at': 1050,
+    }, 100)
+
+
+class StubHelmetHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if self.path == '/v1/token':
+            with server.lock:
+                server.token_requests += 1
+                token = 'stub_token_%d' % server.token_requests
+            # Keep the token request in flight long enough for the other workers to pile up
+            time.sleep(0.2)
+            body = json.dumps({'access_token': token, 'expires_in': 3600}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        with server.lock:
+            server.validated_with.append(self.headers['Authorization'])
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubHelmetServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHelmetHandler)
+        self.lock = threading.Lock()
+        self.token_requests = 0
+        self.validated_with = []
+
+
+@pytest.fixture
+def helmet_server(settings):
+    server = StubHelmetServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    settings.HELMET_API_BASE_URL = 'http://127.0.0.1:%d/v1/' % server.server_address[1]
+    # The token is shared through the cache, so a real one is needed here
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'helmet-tests',
+        }
+    }
+    cache.clear()
 
-    settings.CACHES['default']['TIMEOUT'] = 100
-    validate_patron('1234567', '1234')
-    cache_set.assert_called_with('HELMET_API_ACCESS_TOKEN', 'test_access_token', 100)
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def validate_concurrently(count):
+    barrier = threading.Barrier(count)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(validate_patron('1234567', '1234'))
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_token_is_requested_once_under_concurrency(helmet_server):
+    results = validate_concurrently(10)
+
+    assert results == [True] * 10
+    assert helmet_server.token_requests == 1
+    assert set(helmet_server.validated_with) == {'Bearer stub_token_1'}
+
+
+def test_stale_token_is_used_while_another_worker_refreshes(helmet_server):
+    now = time.time()
+    cache.set(ACCESS_TOKEN_CACHE_KEY, {
+        'token': 'stale_token',
+        'expires_at': now + 30,
+        'refresh_at': now - 30,
+    })
+    # Some other worker holds the refresh lock
+    cache.set(service_token.lock_key, 1)
+
+    results = validate_concurrently(5)
+
+    assert results == [True] * 5
+    assert helmet_server.token_requests == 0
+    assert set(helmet_server.validated_with) == {'Bearer stale_token'}
+
+
+def test_stale_token_is_refreshed_by_one_worker(helmet_server):
+    now = time.time()
+    cache.set(ACCESS_TOKEN_CACHE_KEY, {
+        'token': 'stale_token',
+        'expires_at': now + 30,
+        'refresh_at': now - 30,
+    })
+
+    results = validate_concurrently(5)
+
+    assert results == [True] * 5
+    assert helmet_server.token_requests == 1
+    assert cache.get(ACCESS_TOKEN_CACHE_KEY)['token'] == 'stub_token_1'
@@ -1,10 +1,77 @@
 import datetime
+import hashlib
 from collections import defaultdict
 
+from Cryptodome.PublicKey.RSA import importKey
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from oidc_provider.lib.utils.token import create_id_token, encode_id_token
+from jwkest.jwk import RSAKey as jwk_RSAKey
+from jwkest.jws import JWS
+from oidc_provider.lib.utils.token import create_id_token, get_client_alg_keys
+from oidc_provider.models import RSAKey
 
-from .models import ApiScope
+from tunnistamo.utils import VersionedValue
+
+from .models import ApiScope, api_scope_catalog
+
+API_TOKENS_CACHE_KEY_PREFIX = 'api-tokens:'
+# The claims of the user might change, so the signed tokens are not kept
+# for the whole lifetime of the access token
+DEFAULT_API_TOKENS_CACHE_TIMEOUT = 5 * 60
+
+
+def _load_rsa_keys():
+    return [jwk_RSAKey(key=importKey(rsakey.key), kid=rsakey.kid) for rsakey in RSAKey.objects.all()]
+
+
+# Parsed RSA signing keys, invalidated when the RSA keys change
+rsa_keys = VersionedValue('oidc-rsa-keys-version', _load_rsa_keys)
+
+
+def get_signing_key_id():
+    return ','.join(key.kid for key in rsa_keys.get())
+
+
+def get_api_tokens_cache_key(access_token):
+    digest = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+    return API_TOKENS_CACHE_KEY_PREFIX + digest
+
+
+def invalidate_cached_api_tokens(access_token):
+    if access_token:
+        cache.delete(get_api_tokens_cache_key(access_token))
+
+
+def get_cached_api_tokens_by_access_token(token, request=None):
+    """
+    Get API Tokens for given Access Token, reusing previously signed tokens.
+
+    The signed tokens are cached for OIDC_API_TOKENS_CACHE_TIMEOUT seconds
+    at most, and never longer than the Access Token is valid. They are
+    discarded when the Access Token is saved or deleted and are not used
+    after the signing keys or the APIs and their scopes have changed.
+
+    :rtype: dict[str,str]
+    """
+    cache_key = get_api_tokens_cache_key(token.access_token)
+    versions = {
+        'signing_key_id': get_signing_key_id(),
+        'api_scope_catalog_version': api_scope_catalog.get_version(),
+    }
+
+    cached = cache.get(cache_key)
+    if cached is not None and all(cached.get(name) == value for name, value in versions.items()):
+        return cached['api_tokens']
+
+    api_tokens = get_api_tokens_by_access_token(token, request=request)
+
+    max_timeout = getattr(settings, 'OIDC_API_TOKENS_CACHE_TIMEOUT', DEFAULT_API_TOKENS_CACHE_TIMEOUT)
+    timeout = min(max_timeout, int((token.expires_at - timezone.now()).total_seconds()))
+    if timeout > 0:
+        cache.set(cache_key, dict(versions, api_tokens=api_tokens), timeout)
+
+    return api_tokens
 
 
 def get_api_tokens_by_access_token(token, request=None):
@@ -22,34 +89,70 @@ def get_api_tokens_by_access_token(token, request=None):
     """
     # Limit scopes to known and allowed API scopes
     known_api_scopes = ApiScope.objects.by_identifiers(token.scope)
-    allowed_api_scopes = known_api_scopes.allowed_for_client(token.client)
+    allowed_api_scopes = known_api_scopes.allowed_for_client(token.client).select_related(
+        'api__domain', 'api__oidc_client')
 
     # Group API scopes by the API identifiers
     scopes_by_api = defaultdict(list)
     for api_scope in allowed_api_scopes:
         scopes_by_api[api_scope.api.identifier].append(api_scope)
 
+    generator = ApiTokenGenerator(token, request)
     return {
-        api_identifier: generate_api_token(scopes, token, request)
+        api_identifier: generator.generate(scopes)
         for (api_identifier, scopes) in scopes_by_api.items()
     }
 
 
 def generate_api_token(api_scopes, token, request=None):
-    assert api_scopes
-    api = api_scopes[0].api
-    audience = api.oidc_client.client_id
-    req_scopes = api.required_scopes
+    return ApiTokenGenerator(token, request).generate(api_scopes)
 
-    id_token = create_id_token(
-        token, token.user, aud=audience, request=request, scope=req_scopes)
 
-    payload = {}
-    payload.update(id_token)
-    payload.update(_get_api_authorization_claims(api_scopes))
-    payload['exp'] = _get_api_token_expires_at(token)
+class ApiTokenGenerator:
+    """
+    Generate API tokens for an Access Token.
+
+    The ID token claims are created only once per distinct set of
+    required scopes and the parsed RSA signing keys are shared, so
+    generating tokens for several APIs doesn't repeat that work.
+    """
 
-    return encode_id_token(payload, api.oidc_client)
+    def __init__(self, token, request=None):
+        self.token = token
+        self.request = request
+        self._id_tokens = {}
+        self._rsa_keys = None
+
+    def generate(self, api_scopes):
+        assert api_scopes
+        api = api_scopes[0].api
+
+        payload = {}
+        payload.update(self._get_id_token(api.required_scopes))
+        payload['aud'] = str(api.oidc_client.client_id)
+        payload.update(_get_api_authorization_claims(api_scopes))
+        payload['exp'] = _get_api_token_expires_at(self.token)
+
+        return self._encode(payload, api.oidc_client)
+
+    def _get_id_token(self, required_scopes):
+        key = tuple(sorted(required_scopes))
+        if key not in self._id_tokens:
+            self._id_tokens[key] = create_id_token(
+                self.token, self.token.user, aud='', request=self.request, scope=list(required_scopes))
+        return self._id_tokens[key]
+
+    def _get_keys(self, client):
+        if client.jwt_alg != 'RS256':
+            return get_client_alg_keys(client)
+        if self._rsa_keys is None:
+            self._rsa_keys = rsa_keys.get()
+            if not self._rsa_keys:
+                raise Exception('You must add at least one RSA Key.')
+        return self._rsa_keys
+
+    def _encode(self, payload, client):
+        return JWS(payload, alg=client.jwt_alg).sign_compact(self._get_keys(client))
 
 
 def _get_api_authorization_claims(api_scopes):
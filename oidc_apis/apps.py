@@ -5,3 +5,7 @@ from django.utils.translation import ugettext_lazy as _
 class OidcApisConfig(AppConfig):
     name = 'oidc_apis'
     verbose_name = _('API support for OpenID Connect')
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa
@@ -10,6 +10,7 @@ from parler.managers import TranslatableQuerySet
 from parler.models import TranslatableModel, TranslatedFieldsModel
 
 from oidc_apis.utils import combine_uniquely
+from tunnistamo.utils import VersionedValue
 
 from .mixins import AutoFilledIdentifier, ImmutableFields
 
@@ -179,9 +180,22 @@ class ApiScope(AutoFilledIdentifier, ImmutableFields, TranslatableModel):
 
     @classmethod
     def _get_required_scopes(cls, scopes):
-        api_scopes = ApiScope.objects.by_identifiers(scopes)
-        apis = {x.api for x in api_scopes}
-        return set(sum((list(api.required_scopes) for api in apis), []))
+        catalog = api_scope_catalog.get()
+        required_scopes_by_api = dict(catalog[scope] for scope in scopes if scope in catalog)
+        return set(sum((list(required) for required in required_scopes_by_api.values()), []))
+
+
+def _load_api_scope_catalog():
+    api_scopes = ApiScope.objects.select_related('api__domain')
+    return {
+        api_scope.identifier: (api_scope.api.identifier, tuple(api_scope.api.required_scopes))
+        for api_scope in api_scopes
+    }
+
+
+# Scope identifier -> (API identifier, required scopes of the API), kept in
+# memory of each process and invalidated when APIs or their scopes change.
+api_scope_catalog = VersionedValue('api-scope-catalog-version', _load_api_scope_catalog)
 
 
 class ApiScopeTranslation(TranslatedFieldsModel):
@@ -1,16 +1,65 @@
+import copy
 import re
 
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
-from oidc_provider.lib.claims import ScopeClaims, StandardScopeClaims
+from oidc_provider import settings as oidc_settings
+from oidc_provider.lib.claims import STANDARD_CLAIMS, ScopeClaims, StandardScopeClaims
 from oidc_provider.lib.errors import BearerTokenError
 from social_django.models import UserSocialAuth
 
-from auth_backends.models import SuomiFiAccessLevel
+from auth_backends.models import suomifi_access_levels
 
 from .models import ApiScope
 
 
-class ApiScopeClaims(ScopeClaims):
+class ClaimsContext:
+    """
+    User data shared by the claim classes building the claims of one token.
+
+    Everything is loaded lazily and at most once, so the claim classes
+    don't each query the same tables.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def userinfo(self):
+        claims = copy.deepcopy(STANDARD_CLAIMS)
+        return oidc_settings.get('OIDC_USERINFO', import_str=True)(claims, self.user)
+
+    @cached_property
+    def social_auths(self):
+        return list(UserSocialAuth.objects.filter(user=self.user))
+
+    def get_social_auth(self, provider):
+        return next((social_auth for social_auth in self.social_auths if social_auth.provider == provider), None)
+
+    @cached_property
+    def ad_group_names(self):
+        return list(self.user.ad_groups.all().values_list('name', flat=True))
+
+
+class ContextScopeClaims(ScopeClaims):
+    """ScopeClaims reading the user data from a shared ClaimsContext"""
+
+    def __init__(self, token, context=None):
+        self.context = context or ClaimsContext(token.user)
+        self.user = token.user
+        self.scopes = token.scope
+        self.client = token.client
+
+    @property
+    def userinfo(self):
+        return self.context.userinfo
+
+    @classmethod
+    def handles_scopes(cls, scopes):
+        return any(hasattr(cls, 'scope_' + scope) for scope in scopes)
+
+
+class ApiScopeClaims(ContextScopeClaims):
     @classmethod
     def get_scopes_info(cls, scopes=[]):
         scopes_by_identifier = {
@@ -28,13 +77,12 @@ class ApiScopeClaims(ScopeClaims):
         ]
 
 
-class GithubUsernameScopeClaims(ScopeClaims):
+class GithubUsernameScopeClaims(ContextScopeClaims):
     info_github_username = (
         _("GitHub username"), _("Access to your GitHub username."))
 
     def scope_github_username(self):
-        social_accounts = self.user.social_auth
-        github_account = social_accounts.filter(provider='github').first()
+        github_account = self.context.get_social_auth('github')
         if not github_account:
             return {}
         github_data = github_account.extra_data
@@ -43,36 +91,36 @@ class GithubUsernameScopeClaims(ScopeClaims):
         }
 
 
-class DevicesScopeClaims(ScopeClaims):
+class DevicesScopeClaims(ContextScopeClaims):
     info_devices = (
         _('Devices'), _('Permission to link devices to your user account identities.'))
 
 
-class IdentitiesScopeClaims(ScopeClaims):
+class IdentitiesScopeClaims(ContextScopeClaims):
     info_identities = (
         _('Identities'), _('Access to cards and other identity information.'))
 
 
-class LoginEntriesScopeClaims(ScopeClaims):
+class LoginEntriesScopeClaims(ContextScopeClaims):
     info_login_entries = (
         _('Login history'), _('Access to your login history.'))
 
 
-class UserConsentsScopeClaims(ScopeClaims):
+class UserConsentsScopeClaims(ContextScopeClaims):
     info_user_consents = (
         _('Consents'), _('Permission to view and delete your consents for services.'))
 
 
-class AdGroupsScopeClaims(ScopeClaims):
+class AdGroupsScopeClaims(ContextScopeClaims):
     info_ad_groups = (_("AD Groups"), _("Access to your AD Group memberships."))
 
     def scope_ad_groups(self):
         return {
-            'ad_groups': list(self.user.ad_groups.all().values_list('name', flat=True)),
+            'ad_groups': self.context.ad_group_names,
         }
 
 
-class ReducedStandardScopeClaims(StandardScopeClaims):
+class ReducedStandardScopeClaims(ContextScopeClaims, StandardScopeClaims):
     info_profile = (
         _('Basic profile'),
         _('Access to your basic information, which includes your first and last names.'),
@@ -126,35 +174,30 @@ class ReducedStandardScopeClaims(StandardScopeClaims):
 
     def __insert_student_role_if_applicable(self, attributes):
         # opas_adfs provider inserts "school_role" in the extra data
-        try:
-            social_user = UserSocialAuth.objects.get(user=self.user, provider='opas_adfs')
+        social_user = self.context.get_social_auth('opas_adfs')
+        if social_user is not None:
             extra_data = social_user.extra_data
             key = 'school_role'
             attributes[key] = extra_data[key] if key in extra_data else None
-        except UserSocialAuth.DoesNotExist:
-            pass
 
     def __insert_oid(self, attributes):
-        try:
-            social_user = UserSocialAuth.objects.get(user=self.user)
-            attributes['oid'] = social_user.uid
-        except UserSocialAuth.DoesNotExist:
-            attributes['oid'] = None
+        social_auths = self.context.social_auths
+        if len(social_auths) > 1:
+            raise UserSocialAuth.MultipleObjectsReturned()
+        attributes['oid'] = social_auths[0].uid if social_auths else None
 
 
-class TurkuSuomiFiUserAttributeScopeClaims(ScopeClaims):
+class TurkuSuomiFiUserAttributeScopeClaims(ContextScopeClaims):
     def scope_address(self):
         address = {}
-        try:
-            social_user = UserSocialAuth.objects.get(user=self.user, provider='turku_suomifi')
+        social_user = self.context.get_social_auth('turku_suomifi')
+        if social_user is not None:
             extra_data = social_user.extra_data
             address['address'] = {}
             address['address']['municipality_code'] = extra_data['municipality_code']
             address['address']['municipality_name'] = extra_data['municipality_name']
             address['address']['postal_code'] = extra_data['postal_code']
             address['non_disclosure'] = extra_data['non_disclosure']
-        except UserSocialAuth.DoesNotExist:
-            pass
 
         return address
 
@@ -162,48 +205,57 @@ class TurkuSuomiFiUserAttributeScopeClaims(ScopeClaims):
 class SuomiFiUserAttributeScopeClaimsMeta(type):
     def __dir__(cls):
         names = super().__dir__()
-        for level in SuomiFiAccessLevel.objects.all():
-            names.append('info_suomifi_' + level.shorthand)
+        for shorthand in suomifi_access_levels.get():
+            names.append('info_suomifi_' + shorthand)
         return names
 
     def __getattr__(cls, name):
         match = re.match(r'^info_suomifi_(.*)', name)
         if match:
-            try:
-                level = SuomiFiAccessLevel.objects.get(shorthand=match.group(1))
-                return (level.name, level.description)
-            except SuomiFiAccessLevel.DoesNotExist:
+            level = suomifi_access_levels.get().get(match.group(1))
+            if level is None:
                 raise AttributeError()
+            return (level.name, level.description)
         return super().__getattr__(name)
 
 
-class SuomiFiUserAttributeScopeClaims(ScopeClaims, metaclass=SuomiFiUserAttributeScopeClaimsMeta):
+class SuomiFiUserAttributeScopeClaims(ContextScopeClaims, metaclass=SuomiFiUserAttributeScopeClaimsMeta):
+    @classmethod
+    def handles_scopes(cls, scopes):
+        return any(scope.startswith('suomifi_') for scope in scopes)
+
     def create_response_dic(self):
         dic = {}
-        try:
-            social_user = UserSocialAuth.objects.get(user=self.user, provider='suomifi')
-        except UserSocialAuth.DoesNotExist:
+        levels = suomifi_access_levels.get()
+        requested_levels = [
+            (scope, levels[scope[len('suomifi_'):]])
+            for scope in self.scopes
+            if scope.startswith('suomifi_') and scope[len('suomifi_'):] in levels
+        ]
+        if not requested_levels:
+            return dic
+
+        social_user = self.context.get_social_auth('suomifi')
+        if social_user is None:
             return dic
-        for level in SuomiFiAccessLevel.objects.all():
-            scope = 'suomifi_' + level.shorthand
-            if scope in self.scopes:
-                if scope not in self.client.scope:
-                    raise BearerTokenError('insufficient_scope')
-                dic[scope] = {}
-                for attribute in level.attributes.all():
-                    if attribute.friendly_name in social_user.extra_data['suomifi_attributes']:
-                        dic[scope][attribute.friendly_name] = \
-                            social_user.extra_data['suomifi_attributes'][attribute.friendly_name]
+        suomifi_attributes = social_user.extra_data['suomifi_attributes']
+        for scope, level in requested_levels:
+            if scope not in self.client.scope:
+                raise BearerTokenError('insufficient_scope')
+            dic[scope] = {}
+            for friendly_name in level.attributes:
+                if friendly_name in suomifi_attributes:
+                    dic[scope][friendly_name] = suomifi_attributes[friendly_name]
         dic = self._clean_dic(dic)
         return dic
 
 
-class OptionalOpenIDScopeClaims(ScopeClaims):
+class OptionalOpenIDScopeClaims(ContextScopeClaims):
     def scope_openid(self):
         return {'amr': self.user.last_login_backend} if self.user.last_login_backend else {}
 
 
-class CombinedScopeClaims(ScopeClaims):
+class CombinedScopeClaims(ContextScopeClaims):
     combined_scope_claims = [
         ReducedStandardScopeClaims,
         GithubUsernameScopeClaims,
@@ -237,6 +289,9 @@ class CombinedScopeClaims(ScopeClaims):
     def create_response_dic(self):
         result = super(CombinedScopeClaims, self).create_response_dic()
         for claim_cls in self.combined_scope_claims:
-            claim = claim_cls(self._token)
+            # Skip the claim classes which have nothing to add for the token
+            if not claim_cls.handles_scopes(self.scopes):
+                continue
+            claim = claim_cls(self._token, self.context)
             result.update(claim.create_response_dic())
         return result
@@ -0,0 +1,52 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from oidc_provider.models import RSAKey, Token
+
+from auth_backends.models import SuomiFiAccessLevel, SuomiFiUserAttribute, suomifi_access_levels
+from scopes.api import scope_catalog
+
+from .api_tokens import invalidate_cached_api_tokens, rsa_keys
+from .models import Api, ApiDomain, ApiScope, ApiScopeTranslation, api_scope_catalog
+
+
+def invalidate_api_scope_catalog(sender, instance, **kwargs):
+    api_scope_catalog.invalidate()
+
+
+def invalidate_scope_catalog(sender, instance, **kwargs):
+    scope_catalog.invalidate()
+
+
+def invalidate_suomifi_access_levels(sender, **kwargs):
+    suomifi_access_levels.invalidate()
+
+
+def invalidate_rsa_keys(sender, instance, **kwargs):
+    rsa_keys.invalidate()
+
+
+def invalidate_api_tokens(sender, instance, **kwargs):
+    invalidate_cached_api_tokens(instance.access_token)
+
+
+for model in [ApiDomain, Api, ApiScope]:
+    post_save.connect(invalidate_api_scope_catalog, sender=model)
+    post_delete.connect(invalidate_api_scope_catalog, sender=model)
+# The cached API tokens depend on the clients allowed to use the scopes
+m2m_changed.connect(invalidate_api_scope_catalog, sender=ApiScope.allowed_apps.through)
+
+scope_catalog_models = [
+    ApiScope, ApiScopeTranslation, SuomiFiAccessLevel, SuomiFiAccessLevel._parler_meta.root_model,
+]
+for model in scope_catalog_models:
+    post_save.connect(invalidate_scope_catalog, sender=model)
+    post_delete.connect(invalidate_scope_catalog, sender=model)
+
+for model in [SuomiFiAccessLevel, SuomiFiAccessLevel._parler_meta.root_model, SuomiFiUserAttribute]:
+    post_save.connect(invalidate_suomifi_access_levels, sender=model)
+    post_delete.connect(invalidate_suomifi_access_levels, sender=model)
+m2m_changed.connect(invalidate_suomifi_access_levels, sender=SuomiFiAccessLevel.attributes.through)
+
+post_save.connect(invalidate_rsa_keys, sender=RSAKey)
+post_delete.connect(invalidate_rsa_keys, sender=RSAKey)
+post_save.connect(invalidate_api_tokens, sender=Token)
+post_delete.connect(invalidate_api_tokens, sender=Token)
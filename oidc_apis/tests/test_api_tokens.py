@@ -0,0 +1,118 @@
+from unittest import mock
+
+import pytest
+from Cryptodome.PublicKey import RSA
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+from jwkest.jwt import JWT
+from oidc_provider.models import RSAKey
+
+from oidc_apis.api_tokens import (
+    get_api_tokens_by_access_token, get_api_tokens_cache_key, get_cached_api_tokens_by_access_token, get_signing_key_id
+)
+from oidc_apis.factories import ApiDomainFactory, ApiFactory, ApiScopeFactory
+from oidc_apis.models import ApiScope
+from users.factories import OIDCClientFactory, access_token_factory
+
+
+def rsa_key():
+    key = RSA.generate(1024)
+    return RSAKey.objects.create(key=key.exportKey('PEM').decode('utf8'))
+
+
+@pytest.fixture(autouse=True)
+def default_rsa_key():
+    return rsa_key()
+
+
+def create_token_with_api_scopes(api_count, domain_identifier):
+    client = OIDCClientFactory()
+    domain = ApiDomainFactory(identifier=domain_identifier)
+    api_scopes = []
+    for i in range(api_count):
+        api_scope = ApiScopeFactory(api=ApiFactory(domain=domain, name='api{}'.format(i), required_scopes=['email']))
+        api_scope.allowed_apps.add(client)
+        api_scopes.append(api_scope)
+
+    scopes = ['openid', 'email'] + [api_scope.identifier for api_scope in api_scopes]
+    token = access_token_factory(scopes=scopes, client=client, access_token=get_random_string())
+    token.refresh_token = get_random_string()
+    token.save()
+    return token
+
+
+def count_queries(token, api_count):
+    with CaptureQueriesContext(connection) as context:
+        api_tokens = get_api_tokens_by_access_token(token)
+    assert len(api_tokens) == api_count
+    return len(context.captured_queries)
+
+
+@pytest.mark.django_db
+def test_api_token_content():
+    token = create_token_with_api_scopes(2, 'https://api.example.com/')
+
+    api_tokens = get_api_tokens_by_access_token(token)
+
+    assert set(api_tokens) == {'https://api.example.com/api0', 'https://api.example.com/api1'}
+    payload = JWT().unpack(api_tokens['https://api.example.com/api1']).payload()
+    assert payload['aud'] == 'https://api.example.com/api1'
+    assert payload['https://api.example.com/'] == ['api1']
+    assert payload['sub'] == str(token.user.uuid)
+
+
+@pytest.mark.django_db
+def test_api_token_query_count_does_not_grow_with_apis():
+    token_1 = create_token_with_api_scopes(1, 'https://api1.example.com/')
+    token_10 = create_token_with_api_scopes(10, 'https://api10.example.com/')
+    # Load the per-process signing keys, so that they aren't counted for only one of the tokens
+    get_api_tokens_by_access_token(token_1)
+
+    assert count_queries(token_1, 1) == count_queries(token_10, 10)
+
+
+@pytest.mark.django_db
+def test_signed_api_tokens_are_cached_until_keys_change(django_assert_num_queries):
+    token = create_token_with_api_scopes(2, 'https://api.example.com/')
+
+    api_tokens = get_cached_api_tokens_by_access_token(token)
+
+    with django_assert_num_queries(0):
+        assert get_cached_api_tokens_by_access_token(token) == api_tokens
+
+    rsa_key()
+    assert cache.get(get_api_tokens_cache_key(token.access_token))['signing_key_id'] != get_signing_key_id()
+
+
+@pytest.mark.django_db
+def test_cached_api_tokens_are_purged_with_access_token():
+    token = create_token_with_api_scopes(1, 'https://api.example.com/')
+    get_cached_api_tokens_by_access_token(token)
+
+    token.delete()
+
+    assert cache.get(get_api_tokens_cache_key(token.access_token)) is None
+
+
+@pytest.mark.django_db
+def test_cached_api_tokens_are_not_used_after_api_scope_changes():
+    token = create_token_with_api_scopes(2, 'https://api.example.com/')
+    get_cached_api_tokens_by_access_token(token)
+
+    api_scope = ApiScope.objects.get(api__name='api1')
+    api_scope.allowed_apps.remove(token.client)
+
+    assert set(get_cached_api_tokens_by_access_token(token)) == {'https://api.example.com/api0'}
+
+
+@pytest.mark.django_db
+def test_cached_api_tokens_timeout(settings):
+    settings.OIDC_API_TOKENS_CACHE_TIMEOUT = 10
+    token = create_token_with_api_scopes(1, 'https://api.example.com/')
+
+    with mock.patch('oidc_apis.api_tokens.cache.set') as cache_set:
+        get_cached_api_tokens_by_access_token(token)
+
+    assert cache_set.call_args[0][2] == 10
@@ -0,0 +1,27 @@
+import pytest
+from django.urls import reverse
+from social_django.models import UserSocialAuth
+
+from users.factories import UserFactory, access_token_factory
+
+SCOPES = [
+    'openid', 'profile', 'email', 'address', 'phone', 'birthdate', 'github_username', 'ad_groups', 'login_entries',
+]
+
+
+@pytest.mark.django_db
+def test_userinfo_query_budget(client, django_assert_num_queries):
+    user = UserFactory()
+    UserSocialAuth.objects.create(user=user, provider='github', uid='1234', extra_data={'login': 'octocat'})
+    token = access_token_factory(user=user, scopes=SCOPES)
+    token.id_token = {'sub': str(user.uuid)}
+    token.save()
+
+    url = reverse('oidc_provider:userinfo')
+    with django_assert_num_queries(7):
+        response = client.get(url, HTTP_AUTHORIZATION='Bearer {}'.format(token.access_token))
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data['github_username'] == 'octocat'
+    assert data['oid'] == '1234'
@@ -3,7 +3,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from oidc_provider.lib.utils.oauth2 import protected_resource_view
 
-from .api_tokens import get_api_tokens_by_access_token
+from .api_tokens import get_cached_api_tokens_by_access_token
 
 
 @csrf_exempt
@@ -16,7 +16,7 @@ def get_api_tokens_view(request, token, *args, **kwargs):
     :type token: oidc_provider.models.Token
     :rtype: JsonResponse
     """
-    api_tokens = get_api_tokens_by_access_token(token, request=request)
+    api_tokens = get_cached_api_tokens_by_access_token(token, request=request)
     response = JsonResponse(api_tokens, status=200)
     response['Access-Control-Allow-Origin'] = '*'
     response['Cache-Control'] = 'no-store'
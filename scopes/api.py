@@ -1,6 +1,11 @@
+import hashlib
+import json
+
 from django.conf import settings
 from django.utils import translation
-from django.utils.functional import cached_property
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from rest_framework import serializers
 from rest_framework.schemas import AutoSchema
 from rest_framework.views import APIView
@@ -8,7 +13,7 @@ from rest_framework.views import APIView
 from oidc_apis.models import ApiScope
 from oidc_apis.scopes import CombinedScopeClaims
 from tunnistamo.pagination import DefaultPagination
-from tunnistamo.utils import TranslatableSerializer
+from tunnistamo.utils import TranslatableSerializer, VersionedValue
 
 ENGLISH_LANGUAGE_CODE = 'en'
 LANGUAGE_CODES = [l[0] for l in settings.LANGUAGES]
@@ -34,6 +39,8 @@ class ScopeListView(APIView):
     """
     schema = AutoSchemaWithPaginationParams()
 
+    @method_decorator(vary_on_headers('Accept', 'Accept-Language'))
+    @method_decorator(condition(etag_func=lambda request, *args, **kwargs: get_scope_list_etag(request)))
     def get(self, request, format=None):
         scopes = ScopeDataBuilder().get_scopes_data()
         self.paginator.paginate_queryset(scopes, self.request, view=self)
@@ -52,9 +59,8 @@ class ScopeDataBuilder:
     """
     A builder for scope data to be used in the API.
 
-    Implemented as a class to provide better control of caching. A ScopeDataBuilder instance caches
-    ApiScopes (which are in the db), so in practice there should be an own instance per request
-    to cope with possible modifications.
+    The scope data is served from the per-process scope catalog, which is
+    rebuilt when the scopes change.
     """
     def get_scopes_data(self, only=None):
         """
@@ -69,11 +75,11 @@ class ScopeDataBuilder:
         if only:
             return [s for s in self.scopes_data if s['id'] in only]
         else:
-            return self.scopes_data
+            return list(self.scopes_data)
 
-    @cached_property
+    @property
     def scopes_data(self):
-        return self._get_oidc_scopes_data() + self._get_api_scopes_data()
+        return scope_catalog.get()['scopes']
 
     @classmethod
     def _get_oidc_scopes_data(cls):
@@ -105,3 +111,29 @@ class ScopeDataBuilder:
     @classmethod
     def _get_api_scopes_data(cls):
         return ApiScopeSerializer(ApiScope.objects.order_by('identifier'), many=True).data
+
+
+def _load_scope_catalog():
+    scopes = ScopeDataBuilder._get_oidc_scopes_data() + ScopeDataBuilder._get_api_scopes_data()
+    serialized = json.dumps(scopes, sort_keys=True)
+    return {
+        # Plain data, so that the catalog can't be changed through the serializer output
+        'scopes': tuple(json.loads(serialized)),
+        'etag': hashlib.sha256(serialized.encode('utf-8')).hexdigest(),
+    }
+
+
+# Per-process catalog of all OIDC and API scopes with their translations
+scope_catalog = VersionedValue('scope-catalog-version', _load_scope_catalog)
+
+
+def get_scope_list_etag(request):
+    # Pagination parameters, the renderer and the language change the
+    # response, so they're part of the ETag
+    data = '{}:{}:{}:{}'.format(
+        scope_catalog.get()['etag'],
+        request.GET.urlencode(),
+        request.accepted_media_type,
+        translation.get_language(),
+    )
+    return '"{}"'.format(hashlib.sha256(data.encode('utf-8')).hexdigest())
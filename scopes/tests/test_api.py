@@ -70,3 +70,48 @@ def test_get_also_api_scopes_list(api_client):
 
     assert foo_scope_data['name'] == {'en': foo_scope.name, 'fi': 'nimi'}
     assert foo_scope_data['description'] == {'en': foo_scope.description, 'fi': 'kuvaus'}
+
+
+def test_scope_list_etag(api_client):
+    response = api_client.get(LIST_URL)
+    etag = response['ETag']
+    scope_count = len(response.data['results'])
+
+    response = api_client.get(LIST_URL, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    ApiScopeFactory(api=ApiFactory(domain=ApiDomainFactory(identifier='https://foo.com')))
+
+    response = api_client.get(LIST_URL, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert len(response.data['results']) == scope_count + 1
+
+
+def test_scope_list_etag_depends_on_representation(api_client):
+    response = api_client.get(LIST_URL, HTTP_ACCEPT='application/json', HTTP_ACCEPT_LANGUAGE='en')
+    etag = response['ETag']
+    assert 'Accept' in response['Vary']
+    assert 'Accept-Language' in response['Vary']
+
+    response = api_client.get(LIST_URL, HTTP_ACCEPT='text/html', HTTP_ACCEPT_LANGUAGE='en', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    response = api_client.get(LIST_URL, HTTP_ACCEPT='application/json', HTTP_ACCEPT_LANGUAGE='fi',
+                              HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    response = api_client.get(LIST_URL, HTTP_ACCEPT='application/json', HTTP_ACCEPT_LANGUAGE='en',
+                              HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert 'Accept-Language' in response['Vary']
+
+
+def test_scope_list_is_served_from_catalog(api_client, django_assert_num_queries):
+    api_client.get(LIST_URL)
+
+    with django_assert_num_queries(0):
+        response = api_client.get(LIST_URL)
+    assert response.status_code == 200
@@ -1,12 +1,21 @@
 import datetime
+import functools
+import hashlib
+import hmac
 import json
 import logging
+from types import MappingProxyType
 
 import pytz
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from jwcrypto import jwe, jwk, jwt
+from jwcrypto.common import base64url_decode
 from oidc_provider.lib.errors import BearerTokenError
 from oidc_provider.lib.utils.oauth2 import extract_access_token
 from oidc_provider.models import Token
@@ -20,7 +29,19 @@ User = get_user_model()
 logger = logging.getLogger(__name__)
 local_tz = pytz.timezone(settings.TIME_ZONE)
 
+TOKEN_CACHE_KEY_PREFIX = 'oidc-token:'
+# Upper bound for how long a validated token is kept in the cache. The entry
+# is also never kept past the expiry of the token itself.
+DEFAULT_TOKEN_CACHE_TIMEOUT = 5 * 60
 
+INTERFACE_SECRET_CACHE_KEY_PREFIX = 'interface-secret:'
+# How long a verified interface device secret is accepted without hashing it
+DEFAULT_INTERFACE_SECRET_CACHE_TIMEOUT = 60
+# Minimum number of seconds between writes of UserDevice.last_used_at
+DEFAULT_DEVICE_LAST_USED_AT_INTERVAL = 60
+
+
+@functools.lru_cache(maxsize=4096)
 def parse_scope(scope):
     # Parses scope that are of form <perm>:<domain>:<specifier>.
     # <perm> and <specifier> are optional. The supported perms are 'read' and 'write'.
@@ -43,11 +64,22 @@ def parse_scope(scope):
 
 
 def make_scope_domain_map(scopes):
+    """
+    Return a read-only map of domain -> {(perm, specifier), ...} for the scopes.
+
+    The maps are memoized by the set of scopes, so tokens and views with
+    identical scopes share the same compiled map.
+    """
+    return _compile_scope_domain_map(frozenset(scopes))
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_scope_domain_map(scopes):
     domains = {}
     for scope in scopes:
         perm, domain, specifier = parse_scope(scope)
         domains.setdefault(domain, set()).add((perm, specifier))
-    return domains
+    return MappingProxyType({domain: frozenset(perms) for domain, perms in domains.items()})
 
 
 def get_scope_specifiers(request, domain, perm):
@@ -85,6 +117,58 @@ class TokenAuth:
         self.nonce = nonce
 
 
+def get_token_cache_key(access_token):
+    digest = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+    return TOKEN_CACHE_KEY_PREFIX + digest
+
+
+def invalidate_cached_token(access_token):
+    if access_token:
+        cache.delete(get_token_cache_key(access_token))
+
+
+def get_cached_token_data(access_token):
+    """
+    Return the cached data of the given access token without consulting the
+    database, or None if the token isn't in the cache.
+    """
+    return cache.get(get_token_cache_key(access_token))
+
+
+def get_token_data(access_token):
+    """
+    Return the data needed for authenticating with the given access token.
+
+    The data is served from the cache when possible and the database is
+    consulted only on a cache miss. Tokens that don't exist are not cached.
+
+    :rtype: dict|None
+    :return: Dictionary with 'user_id', 'scope' and 'expires_at' keys or
+             None if the token does not exist
+    """
+    data = get_cached_token_data(access_token)
+    if data is not None:
+        return data
+
+    try:
+        token = Token.objects.get(access_token=access_token)
+    except Token.DoesNotExist:
+        return None
+
+    data = {
+        'user_id': token.user_id,
+        'scope': list(token.scope),
+        'expires_at': token.expires_at,
+    }
+
+    max_timeout = getattr(settings, 'OIDC_TOKEN_CACHE_TIMEOUT', DEFAULT_TOKEN_CACHE_TIMEOUT)
+    timeout = min(max_timeout, int((token.expires_at - timezone.now()).total_seconds()))
+    if timeout > 0:
+        cache.set(get_token_cache_key(access_token), data, timeout)
+
+    return data
+
+
 class OidcTokenAuthentication(BaseAuthentication):
     scopes_needed = ['openid']
 
@@ -92,27 +176,105 @@ class OidcTokenAuthentication(BaseAuthentication):
         access_token = extract_access_token(request)
 
         try:
-            try:
-                token = Token.objects.get(access_token=access_token)
-            except Token.DoesNotExist:
+            token_data = get_token_data(access_token)
+            if token_data is None:
                 logger.debug('[OidcToken] Token does not exist: %s', access_token)
                 return None
 
-            if token.has_expired():
+            if timezone.now() >= token_data['expires_at']:
                 logger.warning('[OidcToken] Token has expired: %s', access_token)
                 raise BearerTokenError('invalid_token')
 
         except BearerTokenError as error:
             raise AuthenticationFailed(error.description)
 
-        auth = TokenAuth(token.scope)
+        auth = TokenAuth(token_data['scope'])
+
+        # The user is loaded only when something actually needs it
+        user_id = token_data['user_id']
+        user = SimpleLazyObject(lambda: User.objects.get(pk=user_id))
 
-        return (token.user, auth)
+        return (user, auth)
 
     def authenticate_header(self, request):
         return "Bearer"
 
 
+@functools.lru_cache(maxsize=1024)
+def _parse_device_keys(device_id, key_fingerprint, key_data):
+    secret_key, public_key = json.loads(key_data)
+    return jwk.JWK(**secret_key), jwk.JWK(**public_key)
+
+
+def get_device_keys(device):
+    """
+    Return the (encryption key, signing key) JWK objects of a UserDevice.
+
+    Parsed keys are cached per process by device id and a fingerprint of the
+    key material, so changed keys are parsed again.
+    """
+    key_data = json.dumps([device.secret_key, device.public_key], sort_keys=True)
+    key_fingerprint = hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+    return _parse_device_keys(str(device.id), key_fingerprint, key_data)
+
+
+def get_interface_secret_cache_key(interface_device, raw_secret_key):
+    # The stored hash is part of the message, so changing the secret
+    # invalidates earlier verifications.
+    message = '{}:{}:{}'.format(interface_device.id, interface_device.secret_key, raw_secret_key)
+    digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+    return INTERFACE_SECRET_CACHE_KEY_PREFIX + digest
+
+
+def check_interface_device_secret(interface_device, raw_secret_key):
+    """
+    Check an interface device secret, skipping the password hasher if the
+    same secret has been verified recently.
+    """
+    cache_key = get_interface_secret_cache_key(interface_device, raw_secret_key)
+    if cache.get(cache_key):
+        return True
+
+    if not interface_device.check_secret_key(raw_secret_key):
+        return False
+
+    timeout = getattr(settings, 'INTERFACE_SECRET_CACHE_TIMEOUT', DEFAULT_INTERFACE_SECRET_CACHE_TIMEOUT)
+    cache.set(cache_key, True, timeout)
+    return True
+
+
+def advance_device_auth_counter(device, auth_counter):
+    """
+    Atomically advance the auth counter of a UserDevice.
+
+    The counter is only advanced if it is lower than the given value, so
+    concurrent requests can't reuse a counter value. Returns False if the
+    counter has already been used. last_used_at is written at most once
+    per DEVICE_LAST_USED_AT_INTERVAL seconds.
+    """
+    now = datetime.datetime.now(tz=local_tz)
+    interval = getattr(settings, 'DEVICE_LAST_USED_AT_INTERVAL', DEFAULT_DEVICE_LAST_USED_AT_INTERVAL)
+    updated = UserDevice.objects.filter(id=device.id, auth_counter__lt=auth_counter).update(
+        auth_counter=auth_counter,
+        last_used_at=Case(
+            When(last_used_at__lt=now - datetime.timedelta(seconds=interval), then=Value(now)),
+            default=F('last_used_at'),
+        ),
+    )
+    if not updated:
+        return False
+    device.auth_counter = auth_counter
+    return True
+
+
+def _get_jwe_header(token_value):
+    try:
+        return json.loads(base64url_decode(token_value.split('.', 1)[0]))
+    except (ValueError, TypeError) as e:
+        logger.info('[DeviceJWT]: %s' % e)
+        raise AuthenticationFailed("Invalid JWE")
+
+
 class DeviceGeneratedJWTAuthentication(BaseAuthentication):
     def authenticate(self, request):  # noqa  (too complex)
         token_value = extract_access_token(request)
@@ -122,23 +284,17 @@ class DeviceGeneratedJWTAuthentication(BaseAuthentication):
             logger.debug('[DeviceJWT]: Probably not a JWE-encrypted token')
             return None
 
-        token = jwt.JWE()
-        try:
-            token.deserialize(token_value)
-        except (jwe.InvalidJWEData, ValueError, TypeError) as e:
-            logger.info('[DeviceJWT]: %s' % e)
-            raise AuthenticationFailed("Invalid JWE")
-
-        if 'iss' not in token.jose_header:
+        # The token is decrypted only once the device and its key are known
+        jose_header = _get_jwe_header(token_value)
+        if not isinstance(jose_header, dict) or 'iss' not in jose_header:
             raise AuthenticationFailed("'iss' field not present in token header")
-        user_device_id = token.jose_header['iss']
+        user_device_id = jose_header['iss']
         try:
             device = UserDevice.objects.get(id=user_device_id)
-        except UserDevice.DoesNotExist:
+        except (UserDevice.DoesNotExist, ValidationError):
             raise AuthenticationFailed("User device %s not registered" % user_device_id)
 
-        enc_key = jwk.JWK(**device.secret_key)
-        sign_key = jwk.JWK(**device.public_key)
+        enc_key, sign_key = get_device_keys(device)
 
         try:
             token = jwt.JWT(algs=['A256KW', 'A128CBC-HS256'])
@@ -151,13 +307,9 @@ class DeviceGeneratedJWTAuthentication(BaseAuthentication):
             raise AuthenticationFailed("Invalid encryption key or signature")
 
         auth_counter = claims.get('cnt', None)
-        if not isinstance(auth_counter, int) or auth_counter <= device.auth_counter:
+        if not isinstance(auth_counter, int) or not advance_device_auth_counter(device, auth_counter):
             raise AuthenticationFailed("Invalid 'cnt' field")
 
-        device.auth_counter = auth_counter
-        device.last_used_at = datetime.datetime.now(tz=local_tz)
-        device.save(update_fields=('auth_counter', 'last_used_at'))
-
         interface_device_id = claims.get('azp', None)
         try:
             interface_device = InterfaceDevice.objects.get(id=interface_device_id)
@@ -166,7 +318,7 @@ class DeviceGeneratedJWTAuthentication(BaseAuthentication):
             raise AuthenticationFailed("Interface device in 'azp' not found")
 
         interface_secret = request.META.get('HTTP_X_INTERFACE_DEVICE_SECRET', '')
-        if interface_device.check_secret_key(interface_secret) is False:
+        if not check_interface_device_secret(interface_device, interface_secret):
             raise AuthenticationFailed("Incorrect interface device secret in X-Interface-Device-Secret HTTP header")
 
         nonce = claims.get('nonce', None)
@@ -179,6 +331,16 @@ class DeviceGeneratedJWTAuthentication(BaseAuthentication):
 
 
 class ScopePermission(BasePermission):
+    @staticmethod
+    def get_required_domains(view, required_scopes):
+        # Required scopes are parsed once per view class
+        view_class = type(view)
+        cached = view_class.__dict__.get('_required_scope_domains')
+        if cached is None or cached[0] != required_scopes:
+            cached = (required_scopes, make_scope_domain_map(required_scopes))
+            view_class._required_scope_domains = cached
+        return cached[1]
+
     def has_permission(self, request, view):
         # If not authenticating through our tokens, do not block permission
         if not isinstance(request.auth, TokenAuth):
@@ -189,7 +351,7 @@ class ScopePermission(BasePermission):
             raise ImproperlyConfigured("View %s doesn't define 'required_scopes'" % view)
 
         token_domains = request.auth.scope_domains
-        required_domains = make_scope_domain_map(required_scopes)
+        required_domains = self.get_required_domains(view, required_scopes)
 
         if request.method in SAFE_METHODS:
             request_perm = 'read'
@@ -0,0 +1,191 @@
+"""
+Logging handlers and formatters for the audit log.
+
+Audit records are put into a bounded in-process queue by AuditLogHandler and
+written by a background thread in batches, so logging an audit event doesn't
+block the request on I/O. This module is referenced from the LOGGING setting,
+so it must not import any models.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+from django.apps import apps
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1
+
+# Attributes present in every LogRecord, anything else has been passed in extra
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as JSON objects, one per line"""
+
+    def format(self, record):
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class BatchFileHandler(logging.FileHandler):
+    """File handler writing a batch of records with a single write"""
+
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(''.join(lines))
+            self.flush()
+        finally:
+            self.release()
+
+
+class DatabaseHandler(logging.Handler):
+    """Handler saving audit records as AuditEvent rows with bulk inserts"""
+
+    COLUMNS = ('event', 'user_uuid', 'user_identifier', 'user_ip')
+
+    def make_event(self, record):
+        AuditEvent = apps.get_model('users', 'AuditEvent')
+
+        context = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        event = AuditEvent(
+            timestamp=datetime.fromtimestamp(record.created, timezone.utc),
+            message=record.getMessage(),
+        )
+        for column in self.COLUMNS:
+            setattr(event, column, context.pop(column, None))
+        event.event = event.event or ''
+        event.data = context
+        return event
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        try:
+            events = [self.make_event(record) for record in records]
+            apps.get_model('users', 'AuditEvent').objects.bulk_create(events)
+        except Exception:
+            logging.getLogger(__name__).exception('Saving %d audit events failed', len(records))
+
+
+class AuditLogHandler(logging.handlers.QueueHandler):
+    """Queue audit records for a background writer thread
+
+    `target` is the dotted path of the handler class doing the actual
+    writing, instantiated with `target_kwargs`. If the target has an
+    `emit_batch` method, records are handed to it in batches. When the queue
+    is full, new records are dropped and counted.
+    """
+
+    def __init__(self, target='logging.StreamHandler', target_kwargs=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = import_string(target)(**(target_kwargs or {}))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Formatting is left to the writer thread. Only the parts which might
+        # change or can't be pickled are resolved here.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Write all currently queued records"""
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                break
+            self._write(batch)
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
+
+    def _ensure_writer(self):
+        # The writer is started lazily and restarted in forked worker processes
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _take_batch(self, block=True):
+        batch = []
+        try:
+            batch.append(self.queue.get(block=block, timeout=self.flush_interval if block else None))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        if hasattr(self.target, 'emit_batch'):
+            self.target.emit_batch(batch)
+            return
+        for record in batch:
+            self.target.handle(record)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+                close_old_connections()
@@ -1,10 +1,20 @@
 import logging
+
 from oidc_provider.models import Client
 
+from tunnistamo.utils import VersionedValue
 
 logger = logging.getLogger('tunnistamo.audit')
 
 
+def _load_client_names():
+    return dict(Client.objects.values_list('client_id', 'name'))
+
+
+# Per-process directory of OIDC client names by client_id
+client_names = VersionedValue('oidc-client-names-version', _load_client_names)
+
+
 def _log_audit_message(request, event_name, message, extra_context=None):
     context = {
         'event': event_name,
@@ -22,8 +32,7 @@ def _log_audit_message(request, event_name, message, extra_context=None):
     if extra_context is not None:
         context.update(extra_context)
 
-    adapter = logging.LoggerAdapter(logger, context)
-    adapter.info(message)
+    logger.info(message, extra=context)
 
 
 def log_admin_view(request):
@@ -41,17 +50,10 @@ def log_admin_action(request, msg):
 
 
 def log_authorize(request):
-    client = None
     client_id = request.GET.get('client_id', None)
-    if client_id is not None:
-        try:
-            client = Client.objects.get(client_id=client_id)
-        except Client.DoesNotExist:
-            pass
-
     extra_context = {
         'oidc_client_id': client_id,
-        'oidc_client_name': client.name,
+        'oidc_client_name': client_names.get().get(client_id),
     }
     if request.method == 'GET':
         event_name = 'authorize'
@@ -0,0 +1,131 @@
+"""
+Circuit breakers for calls to upstream services.
+
+Outcomes of the requests to an upstream are counted in fixed time windows.
+When enough of them fail, the circuit of the upstream opens and logins using
+it fail fast instead of tying up workers waiting for a broken service. After
+the open period a limited number of probe requests are let through: a
+successful probe closes the circuit and a failed one opens it again.
+
+The state is kept in the default cache, so that all worker processes share
+it. Settings of an upstream can be overridden in the CIRCUIT_BREAKERS
+setting, e.g.
+
+    CIRCUIT_BREAKERS = {
+        'koha': {'failure_rate': 0.8, 'open_timeout': 60},
+    }
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_BREAKER_SETTINGS = {
+    # Ratio of failed requests in a window which opens the circuit
+    'failure_rate': 0.5,
+    # Minimum number of requests in a window before the circuit can open
+    'minimum_requests': 10,
+    # Length of the counting window in seconds
+    'window': 60,
+    # Seconds the circuit stays open before probe requests are let through
+    'open_timeout': 30,
+    # Number of concurrent probe requests while half-open
+    'half_open_probes': 1,
+}
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate, minimum_requests, window, open_timeout, half_open_probes):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_requests = minimum_requests
+        self.window = window
+        self.open_timeout = open_timeout
+        self.half_open_probes = half_open_probes
+
+        self.state_key = 'circuit_breaker:%s:opened_at' % name
+        self.probes_key = 'circuit_breaker:%s:probes' % name
+
+    def get_state(self):
+        opened_at = cache.get(self.state_key)
+        if opened_at is None:
+            return CLOSED
+        if time.time() < opened_at + self.open_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def is_available(self):
+        """Return False while the circuit is open, without using up a probe"""
+        return self.get_state() != OPEN
+
+    def allow_request(self):
+        """Return whether a request to the upstream may be made now"""
+        state = self.get_state()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        return self._incr(self.probes_key, self.open_timeout) <= self.half_open_probes
+
+    def record_success(self):
+        state = self.get_state()
+        if state == HALF_OPEN:
+            self.close()
+        if state != CLOSED:
+            # Requests started before the circuit opened don't count
+            return
+        self._incr(self._window_key('requests'), self.window)
+
+    def record_failure(self):
+        state = self.get_state()
+        if state == HALF_OPEN:
+            # A failed probe opens the circuit again
+            self.open()
+        if state != CLOSED:
+            return
+
+        requests = self._incr(self._window_key('requests'), self.window)
+        failures = self._incr(self._window_key('failures'), self.window)
+        if requests >= self.minimum_requests and failures >= requests * self.failure_rate:
+            self.open()
+
+    def open(self):
+        # Kept a while after the open period so that the circuit stays
+        # half-open until a probe succeeds
+        cache.set(self.state_key, time.time(), self.open_timeout + self.window)
+        cache.delete(self.probes_key)
+
+    def close(self):
+        cache.delete_many([
+            self.state_key,
+            self.probes_key,
+            self._window_key('requests'),
+            self._window_key('failures'),
+        ])
+
+    def _window_key(self, counter):
+        return 'circuit_breaker:%s:%s:%d' % (self.name, counter, time.time() // self.window)
+
+    def _incr(self, key, timeout):
+        cache.add(key, 0, timeout)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # The key expired between add and incr
+            cache.set(key, 1, timeout)
+            return 1
+
+
+def get_breaker_settings(upstream):
+    breaker_settings = dict(DEFAULT_BREAKER_SETTINGS)
+    breaker_settings.update(getattr(settings, 'CIRCUIT_BREAKERS', {}).get(upstream, {}))
+    return breaker_settings
+
+
+def get_breaker(upstream):
+    """Return the circuit breaker of `upstream`"""
+    return CircuitBreaker(upstream, **get_breaker_settings(upstream))
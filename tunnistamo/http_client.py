@@ -0,0 +1,130 @@
+"""
+Shared HTTP sessions for calls to upstream services.
+
+Each upstream gets its own pooled keep-alive `requests.Session` per process,
+with default timeouts and retries. The outcomes of the requests are recorded
+in the circuit breaker of the upstream. Settings of an upstream can be overridden
+in the HTTP_CLIENTS setting, e.g.
+
+    HTTP_CLIENTS = {
+        'koha': {'timeout': (3.05, 20), 'pool_size': 20},
+    }
+"""
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tunnistamo.circuit_breaker import get_breaker
+
+DEFAULT_CLIENT_SETTINGS = {
+    # (connect, read) timeouts in seconds
+    'timeout': (3.05, 10),
+    # Maximum number of pooled connections per host
+    'pool_size': 10,
+    # Failed connections are retried for all methods. Read errors and
+    # responses with a status in `retry_statuses` are only retried for
+    # idempotent methods.
+    'retries': 2,
+    'retry_statuses': (502, 503, 504),
+    'backoff_factor': 0.1,
+}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of making a request while the circuit of the upstream is open"""
+
+
+class TimeoutSession(requests.Session):
+    """Session applying a default timeout to all requests
+
+    If a circuit breaker is given, requests are only made when the breaker
+    allows them. Connection errors and 5xx responses are recorded as its
+    failures and other responses as its successes. While the circuit is half
+    open, a probe is taken right before the request, so that every probe gets
+    an outcome.
+    """
+
+    def __init__(self, timeout, breaker=None):
+        super().__init__()
+        self.timeout = timeout
+        self.breaker = breaker
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.breaker is None:
+            return super().request(method, url, **kwargs)
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError('Circuit of %s is open' % self.breaker.name)
+        try:
+            resp = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+
+def get_client_settings(upstream):
+    client_settings = dict(DEFAULT_CLIENT_SETTINGS)
+    client_settings.update(getattr(settings, 'HTTP_CLIENTS', {}).get(upstream, {}))
+    return client_settings
+
+
+def get_max_request_time(upstream):
+    """Return the longest time in seconds a request to `upstream` can take, including retries"""
+    client_settings = get_client_settings(upstream)
+    timeout = client_settings['timeout']
+    attempt_time = sum(timeout) if isinstance(timeout, (list, tuple)) else timeout
+    retries = client_settings['retries']
+    backoff_time = sum(client_settings['backoff_factor'] * 2 ** i for i in range(retries))
+    return attempt_time * (retries + 1) + backoff_time
+
+
+def create_session(upstream):
+    client_settings = get_client_settings(upstream)
+    retries = client_settings['retries']
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=client_settings['retry_statuses'],
+        backoff_factor=client_settings['backoff_factor'],
+        # Return the last response instead of raising when status retries run out
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=client_settings['pool_size'], max_retries=retry)
+
+    session = TimeoutSession(client_settings['timeout'], breaker=get_breaker(upstream))
+    # The session is shared by all users, so cookies set by the upstream for
+    # one user must not be sent on the requests of the others
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(upstream):
+    """Return the shared session for calls to `upstream`"""
+    # Pooled connections must not be shared with forked worker processes
+    key = (upstream, os.getpid())
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = create_session(upstream)
+                _sessions[key] = session
+    return session
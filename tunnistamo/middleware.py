@@ -1,9 +1,13 @@
+import base64
+import binascii
 import json
 import logging
+import re
 from datetime import timedelta
 
 from django.conf import settings
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.utils import timezone
 from django.utils.http import urlencode, is_safe_url
 from django.utils.translation import ugettext_lazy as _
@@ -186,3 +190,112 @@ class RealClientIPMiddleware(object):
             request.META['REMOTE_ADDR'] = ips[0]
 
         return self.get_response(request)
+
+
+def _get_basic_auth_username(request):
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'basic':
+        return None
+    try:
+        return base64.b64decode(auth[1]).decode('utf-8').split(':', 1)[0]
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+
+
+class RateLimitMiddleware:
+    """Limit request rates of the endpoints listed in RATELIMIT_ENDPOINTS
+
+    The middleware is placed before the session and authentication
+    middlewares, so rejected requests don't cause any session work. For the
+    same reason the 'user_or_ip' key identifies users by their bearer token
+    instead of request.user. Only clients and valid tokens already known to
+    the process get their own bucket, so that made up client ids or tokens
+    can't be used for getting around the limits of an IP address. Neither
+    is looked up from the database before the request has been allowed.
+    """
+    KEYS = ('client_id', 'user_or_ip', 'ip')
+
+    def __init__(self, get_response):
+        rules = getattr(settings, 'RATELIMIT_ENDPOINTS', None)
+        if not rules:
+            raise MiddlewareNotUsed()
+
+        # Importing ratelimit fails with caches not suitable for rate limiting.
+        # The others need the app registry, which isn't ready when this
+        # module is imported by the system checks.
+        from tunnistamo import ratelimit
+        from tunnistamo.api_common import get_cached_token_data
+        from tunnistamo.auditlog import client_names
+
+        self.ratelimit = ratelimit
+        self.get_cached_token_data = get_cached_token_data
+        self.client_names = client_names
+        self.get_response = get_response
+        self.rules = []
+        for rule in rules:
+            if rule['key'] not in self.KEYS:
+                raise ImproperlyConfigured('Unknown endpoint ratelimit key: %s' % rule['key'])
+            self.rules.append(dict(rule, path=re.compile(rule['path'])))
+
+    def _ip_key(self, group, request):
+        return self.ratelimit.ip_mask(request.META['REMOTE_ADDR'])
+
+    def _client_id_key(self, group, request):
+        client_id = (
+            request.POST.get('client_id') or request.GET.get('client_id') or
+            _get_basic_auth_username(request)
+        )
+        ip_key = self._ip_key(group, request)
+        # The directory of clients isn't reloaded here even if it's out of
+        # date; new clients share the limit of their IP until it is
+        known_clients = self.client_names.peek() or {}
+        if client_id and client_id in known_clients:
+            # The client isn't authenticated yet, so the IP is included to
+            # keep others from using up the limit of a client
+            return 'client:%s:%s' % (client_id, ip_key)
+        return ip_key
+
+    def _user_or_ip_key(self, group, request):
+        auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(auth) == 2 and auth[0].lower() == 'bearer':
+            # A token gets cached when it's first used for authentication
+            token_data = self.get_cached_token_data(auth[1])
+            if token_data is not None and timezone.now() < token_data['expires_at']:
+                return 'user:%s' % token_data['user_id']
+        return self._ip_key(group, request)
+
+    def get_rule(self, request):
+        path = request.path_info.lstrip('/')
+        for rule in self.rules:
+            if rule['path'].match(path):
+                return rule
+        return None
+
+    def __call__(self, request):
+        rule = self.get_rule(request)
+        if rule is None:
+            return self.get_response(request)
+
+        usage = self.ratelimit.get_usage(
+            request,
+            group='endpoint:%s' % rule['path'].pattern,
+            key=getattr(self, '_%s_key' % rule['key']),
+            rate=rule['rate'],
+            method=rule.get('method', self.ratelimit.ALL),
+            increment=True,
+        )
+        if usage is None:
+            return self.get_response(request)
+
+        if usage['should_limit']:
+            logger.warning('Rate limit exceeded for %s', request.path)
+            response = HttpResponse('Too many requests', status=429, content_type='text/plain')
+            if usage['time_left'] > 0:
+                response['Retry-After'] = str(usage['time_left'])
+        else:
+            response = self.get_response(request)
+
+        response['X-RateLimit-Limit'] = str(usage['limit'])
+        response['X-RateLimit-Remaining'] = str(max(usage['limit'] - usage['count'], 0))
+        response['X-RateLimit-Reset'] = str(max(usage['time_left'], 0))
+        return response
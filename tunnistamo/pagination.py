@@ -1,6 +1,14 @@
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
 
 
 class DefaultPagination(LimitOffsetPagination):
     default_limit = 100
     max_limit = 1000
+
+
+class KeysetPagination(CursorPagination):
+    """Paginate by the last seen id instead of an offset, for large tables"""
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
@@ -6,7 +6,9 @@
 import ipaddress
 import functools
 import hashlib
+import math
 import re
+import threading
 import time
 import zlib
 
@@ -16,7 +18,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.utils.module_loading import import_string
 from django.core.cache.backends.locmem import LocMemCache
 
-__all__ = ['is_ratelimited', 'get_usage']
+__all__ = ['is_ratelimited', 'get_usage', 'get_stats']
 
 _PERIODS = {
     's': 1,
@@ -31,6 +33,14 @@ UNSAFE = ['DELETE', 'PATCH', 'POST', 'PUT']
 # Extend the expiration time by a few seconds to avoid misses.
 EXPIRATION_FUDGE = 5
 
+# Limiting algorithms
+FIXED_WINDOW = 'fixed-window'
+SLIDING_WINDOW = 'sliding-window'
+TOKEN_BUCKET = 'token-bucket'
+
+# Maximum number of limited keys remembered in-process
+DEFAULT_LOCAL_CACHE_SIZE = 10000
+
 ratelimit_cache = caches[getattr(settings, 'RATELIMIT_USE_CACHE', 'default')]
 if isinstance(ratelimit_cache, LocMemCache):
     raise ImproperlyConfigured('Ratelimit cache backend must not be LocMemCache')
@@ -124,6 +134,290 @@ def _make_cache_key(group, window, rate, value, methods):
     return prefix + hashlib.md5(u''.join(parts).encode('utf-8')).hexdigest()
 
 
+class CacheEngine:
+    """
+    Rate limiter engine using the generic Django cache API.
+
+    The fixed window algorithm is atomic on caches with an atomic `incr`.
+    The sliding window and token bucket algorithms need separate reads and
+    writes, so they are only approximate under concurrent use.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _hit_window(self, cache_key, period, increment, timeout):
+        initial_value = 1 if increment else 0
+        if self.cache.add(cache_key, initial_value, timeout):
+            return initial_value
+        if increment:
+            try:
+                # python3-memcached will throw a ValueError if the server is
+                # unavailable or (somehow) the key doesn't exist. redis, on the
+                # other hand, simply returns None.
+                return self.cache.incr(cache_key)
+            except ValueError:
+                return None
+        return self.cache.get(cache_key, initial_value)
+
+    def fixed_window(self, cache_keys, limit, period, increment):
+        return self._hit_window(cache_keys[0], period, increment, period + EXPIRATION_FUDGE)
+
+    def sliding_window(self, cache_keys, limit, period, increment):
+        # The current window is also read as the previous one later on
+        count = self._hit_window(cache_keys[0], period, increment, 2 * period + EXPIRATION_FUDGE)
+        if count is None:
+            return None
+        return count, self.cache.get(cache_keys[1], 0)
+
+    def token_bucket(self, cache_keys, limit, period, increment, now):
+        tokens, ts = self.cache.get(cache_keys[0], (limit, now))
+        tokens = _refill_tokens(tokens, ts, limit, period, now, increment)
+        self.cache.set(cache_keys[0], (tokens, now), period + EXPIRATION_FUDGE)
+        return tokens
+
+    def reset(self, cache_keys):
+        self.cache.delete_many(cache_keys)
+
+
+_REDIS_FIXED_WINDOW_SCRIPT = """
+local count
+if ARGV[1] == '1' then
+    count = redis.call('INCR', KEYS[1])
+    if count == 1 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+else
+    count = tonumber(redis.call('GET', KEYS[1]) or '0')
+end
+return count
+"""
+
+_REDIS_SLIDING_WINDOW_SCRIPT = """
+local count
+if ARGV[1] == '1' then
+    count = redis.call('INCR', KEYS[1])
+    if count == 1 then
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+else
+    count = tonumber(redis.call('GET', KEYS[1]) or '0')
+end
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+return {count, previous}
+"""
+
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + math.max(now - ts, 0) * limit / period)
+if ARGV[4] == '1' then
+    tokens = math.max(tokens - 1, -1)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(tokens)
+"""
+
+
+class RedisEngine:
+    """
+    Rate limiter engine running the algorithms as Lua scripts in Redis.
+
+    Each check is a single atomic round-trip. Requires the rate limit cache
+    to be a django-redis cache. Redis errors are treated like failures of the
+    cache, i.e. the checks return None.
+    """
+
+    def __init__(self, cache):
+        from django_redis import get_redis_connection
+        from redis.exceptions import RedisError
+
+        self.cache = cache
+        self.errors = RedisError
+        self.client = get_redis_connection(getattr(settings, 'RATELIMIT_USE_CACHE', 'default'))
+        self._fixed_window = self.client.register_script(_REDIS_FIXED_WINDOW_SCRIPT)
+        self._sliding_window = self.client.register_script(_REDIS_SLIDING_WINDOW_SCRIPT)
+        self._token_bucket = self.client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+
+    def _keys(self, cache_keys):
+        return [self.cache.make_key(cache_key) for cache_key in cache_keys]
+
+    def fixed_window(self, cache_keys, limit, period, increment):
+        try:
+            count = self._fixed_window(
+                keys=self._keys(cache_keys),
+                args=[int(increment), period + EXPIRATION_FUDGE],
+            )
+        except self.errors:
+            return None
+        return int(count)
+
+    def sliding_window(self, cache_keys, limit, period, increment):
+        try:
+            count, previous = self._sliding_window(
+                keys=self._keys(cache_keys),
+                args=[int(increment), 2 * period + EXPIRATION_FUDGE],
+            )
+        except self.errors:
+            return None
+        return int(count), int(previous)
+
+    def token_bucket(self, cache_keys, limit, period, increment, now):
+        try:
+            tokens = self._token_bucket(
+                keys=self._keys(cache_keys),
+                args=[limit, period, repr(now), int(increment), period + EXPIRATION_FUDGE],
+            )
+        except self.errors:
+            return None
+        return float(tokens)
+
+    def reset(self, cache_keys):
+        try:
+            self.client.delete(*self._keys(cache_keys))
+        except self.errors:
+            pass
+
+
+def _refill_tokens(tokens, ts, limit, period, now, increment):
+    tokens = min(limit, tokens + max(now - ts, 0) * limit / period)
+    if increment:
+        tokens = max(tokens - 1, -1)
+    return tokens
+
+
+_engine = None
+
+
+def get_engine():
+    global _engine
+
+    if _engine is None:
+        engine_class = import_string(getattr(settings, 'RATELIMIT_ENGINE', 'tunnistamo.ratelimit.CacheEngine'))
+        _engine = engine_class(ratelimit_cache)
+    return _engine
+
+
+def _get_cache_keys(algorithm, group, window, rate, value, methods, period):
+    if algorithm == FIXED_WINDOW:
+        return [_make_cache_key(group, window, rate, value, methods)]
+    if algorithm == SLIDING_WINDOW:
+        return [
+            _make_cache_key(group, window, rate, value, methods),
+            _make_cache_key(group, window - period, rate, value, methods),
+        ]
+    if algorithm == TOKEN_BUCKET:
+        return [_make_cache_key(group, 'bucket', rate, value, methods)]
+    raise ImproperlyConfigured('Unknown ratelimit algorithm: %s' % algorithm)
+
+
+def _check_limit(engine, algorithm, cache_keys, limit, period, window, increment):
+    """
+    Run the limiting algorithm. Returns a (count, time_left) tuple or None if
+    the engine failed to get or set the count.
+    """
+    if algorithm == TOKEN_BUCKET:
+        now = time.time()
+        tokens = engine.token_bucket(cache_keys, limit, period, increment, now)
+        if tokens is None:
+            return None
+        count = int(math.ceil(limit - tokens))
+        # Time until the next token is available
+        time_left = int(math.ceil((1 - tokens) * period / limit)) if tokens < 1 else 0
+        return count, time_left
+
+    time_left = window - int(time.time())
+
+    if algorithm == SLIDING_WINDOW:
+        counts = engine.sliding_window(cache_keys, limit, period, increment)
+        if counts is None:
+            return None
+        count, previous = counts
+        # Weigh the previous window by how much of it still overlaps the
+        # sliding window ending now.
+        count += int(previous * time_left / period)
+        return count, time_left
+
+    count = engine.fixed_window(cache_keys, limit, period, increment)
+    if count is None:
+        return None
+    return count, time_left
+
+
+class KnownLimited:
+    """
+    In-process memory of keys that are currently rate limited.
+
+    A key seen as limited is remembered until its window expires, so
+    repeated blocked attempts are rejected without contacting the shared
+    cache.
+    """
+
+    def __init__(self, max_size=DEFAULT_LOCAL_CACHE_SIZE):
+        self.max_size = max_size
+        self.stats = {
+            'local_hits': 0,
+            'remote_checks': 0,
+            'fail_open': 0,
+        }
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, usage = entry
+        time_left = expires - time.time()
+        if time_left <= 0:
+            self._entries.pop(key, None)
+            return None
+        self.count('local_hits')
+        return dict(usage, time_left=int(math.ceil(time_left)))
+
+    def add(self, key, usage):
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._prune()
+            if len(self._entries) >= self.max_size:
+                return
+            self._entries[key] = (time.time() + usage['time_left'], usage)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['limited_keys'] = len(self._entries)
+        return stats
+
+    def _prune(self):
+        now = time.time()
+        for key, (expires, usage) in list(self._entries.items()):
+            if expires <= now:
+                del self._entries[key]
+
+
+known_limited = KnownLimited(getattr(settings, 'RATELIMIT_LOCAL_CACHE_SIZE', DEFAULT_LOCAL_CACHE_SIZE))
+
+
+def get_stats():
+    return known_limited.get_stats()
+
+
 def is_ratelimited(request, group=None, fn=None, key=None, rate=None,
                    method=ALL, increment=False):
     usage = get_usage(request, group, fn, key, rate, method, increment)
@@ -134,7 +428,7 @@ def is_ratelimited(request, group=None, fn=None, key=None, rate=None,
 
 
 def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
-              increment=False, reset=False):
+              increment=False, reset=False, algorithm=None):
     if group is None and fn is None:
         raise ImproperlyConfigured('get_usage must be called with either '
                                    '`group` or `fn` arguments')
@@ -189,34 +483,29 @@ def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
         raise ImproperlyConfigured(
             'Could not understand ratelimit key: %s' % key)
 
-    window = _get_window(value, period)
-    initial_value = 1 if increment else 0
+    if algorithm is None:
+        algorithm = getattr(settings, 'RATELIMIT_ALGORITHM', FIXED_WINDOW)
 
-    cache_key = _make_cache_key(group, window, rate, value, method)
+    window = _get_window(value, period)
+    cache_keys = _get_cache_keys(algorithm, group, window, rate, value, method, period)
+    engine = get_engine()
 
-    count = None
     if reset:
-        ratelimit_cache.delete(cache_key)
+        known_limited.discard(cache_keys[0])
+        engine.reset(cache_keys)
         return
 
-    added = ratelimit_cache.add(cache_key, initial_value, period + EXPIRATION_FUDGE)
-    if added:
-        count = initial_value
-    else:
-        if increment:
-            try:
-                # python3-memcached will throw a ValueError if the server is
-                # unavailable or (somehow) the key doesn't exist. redis, on the
-                # other hand, simply returns None.
-                count = ratelimit_cache.incr(cache_key)
-            except ValueError:
-                pass
-        else:
-            count = ratelimit_cache.get(cache_key, initial_value)
+    usage = known_limited.get(cache_keys[0])
+    if usage is not None:
+        return usage
+
+    known_limited.count('remote_checks')
+    result = _check_limit(engine, algorithm, cache_keys, limit, period, window, increment)
 
     # Getting or setting the count from the cache failed
-    if count is None:
+    if result is None:
         if getattr(settings, 'RATELIMIT_FAIL_OPEN', False):
+            known_limited.count('fail_open')
             return None
         return {
             'count': 0,
@@ -225,13 +514,16 @@ def get_usage(request, group=None, fn=None, key=None, rate=None, method=ALL,
             'time_left': -1,
         }
 
-    time_left = window - int(time.time())
-    return {
+    count, time_left = result
+    usage = {
         'count': count,
         'limit': limit,
         'should_limit': count > limit,
         'time_left': time_left,
     }
+    if usage['should_limit'] and time_left > 0:
+        known_limited.add(cache_keys[0], usage)
+    return usage
 
 
 is_ratelimited.ALL = ALL
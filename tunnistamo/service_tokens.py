@@ -0,0 +1,124 @@
+"""
+Cached access tokens for calls to upstream services.
+
+ServiceToken keeps a token obtained by e.g. an OAuth client credentials grant
+in the cache and refreshes it a while before it expires. Only one worker at
+a time fetches a new token: the others keep using the current token while it
+is still valid, or wait for the new token to appear in the cache.
+"""
+import math
+import threading
+import time
+
+from django.core.cache import cache
+
+from tunnistamo.http_client import get_max_request_time
+
+DEFAULT_REFRESH_MARGIN = 60
+DEFAULT_LOCK_TIMEOUT = 10
+# Time added to the longest possible token request for the refresh lock
+LOCK_TIMEOUT_MARGIN = 5
+LOCK_POLL_INTERVAL = 0.05
+
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+def _get_local_lock(key):
+    with _local_locks_lock:
+        return _local_locks.setdefault(key, threading.Lock())
+
+
+class ServiceToken:
+    """Access token shared by all workers through the cache
+
+    `fetch` is called without arguments to obtain a new token and must return
+    a `(token, expires_in)` tuple. The token is refreshed `refresh_margin`
+    seconds before it expires, but at most halfway through its lifetime.
+
+    The refresh lock must not expire while the token is being fetched, so
+    if the token is fetched from `upstream` using its shared HTTP session, the
+    lock is held as long as the requests with their retries can take.
+    """
+
+    def __init__(self, cache_key, fetch, refresh_margin=DEFAULT_REFRESH_MARGIN, lock_timeout=None, upstream=None):
+        self.cache_key = cache_key
+        self.lock_key = '%s:lock' % cache_key
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self._lock_timeout = lock_timeout
+        self.upstream = upstream
+
+    @property
+    def lock_timeout(self):
+        if self._lock_timeout is not None:
+            return self._lock_timeout
+        if self.upstream is None:
+            return DEFAULT_LOCK_TIMEOUT
+        return max(DEFAULT_LOCK_TIMEOUT, math.ceil(get_max_request_time(self.upstream)) + LOCK_TIMEOUT_MARGIN)
+
+    def get(self):
+        entry = cache.get(self.cache_key)
+        if self._is_fresh(entry):
+            return entry['token']
+
+        local_lock = _get_local_lock(self.cache_key)
+        # Don't wait for another thread refreshing the token if the current one is still valid
+        if not local_lock.acquire(blocking=not self._is_valid(entry)):
+            return entry['token']
+        try:
+            # Another thread might have refreshed the token while we waited for the lock
+            entry = cache.get(self.cache_key)
+            if self._is_fresh(entry):
+                return entry['token']
+
+            if cache.add(self.lock_key, 1, self.lock_timeout):
+                try:
+                    return self._refresh()
+                finally:
+                    cache.delete(self.lock_key)
+
+            # Some other worker is already refreshing the token
+            if self._is_valid(entry):
+                return entry['token']
+            return self._wait_for_refresh()
+        finally:
+            local_lock.release()
+
+    def invalidate(self, token):
+        """Drop `token` from the cache, e.g. after the upstream has rejected it"""
+        entry = cache.get(self.cache_key)
+        if entry and entry['token'] == token:
+            cache.delete(self.cache_key)
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.time() < entry['refresh_at']
+
+    def _is_valid(self, entry):
+        return entry is not None and time.time() < entry['expires_at']
+
+    def _refresh(self):
+        token, expires_in = self.fetch()
+        if expires_in > 0:
+            now = time.time()
+            entry = {
+                'token': token,
+                'expires_at': now + expires_in,
+                'refresh_at': now + expires_in - min(self.refresh_margin, expires_in / 2),
+            }
+            cache.set(self.cache_key, entry, expires_in)
+        return token
+
+    def _wait_for_refresh(self):
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline and cache.get(self.lock_key) is not None:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = cache.get(self.cache_key)
+            if self._is_valid(entry):
+                return entry['token']
+
+        # The refreshing worker failed or took too long
+        entry = cache.get(self.cache_key)
+        if self._is_valid(entry):
+            return entry['token']
+        return self._refresh()
@@ -62,6 +62,12 @@ env = environ.Env(
     SOCIAL_AUTH_SUOMIFI_UI_INFO=(str, ""),
     SOCIAL_AUTH_SUOMIFI_UI_LOGO=(str, ""),
 
+    # Write user login entries in batches from a background thread
+    USER_LOGIN_ENTRY_ASYNC=(bool, False),
+    ENDPOINT_RATELIMIT_ENABLED=(bool, False),
+    AUDIT_LOG_FILE=(str, ''),
+    AUDIT_LOG_DATABASE=(bool, False),
+
     # Needs to be true for Dockerfile collectstatic, since cert files don't yet exist then
     SKIP_CERTIFICATES=(str, ""),
 )
@@ -140,6 +146,7 @@ INSTALLED_APPS = (
 
 MIDDLEWARE = (
     'tunnistamo.middleware.RealClientIPMiddleware',
+    'tunnistamo.middleware.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -314,6 +321,9 @@ LOGGING = {
         'simple': {
             'format': '%(module)s %(asctime)s %(levelname)s %(message)s'
         },
+        'json': {
+            '()': 'tunnistamo.audit_logging.JSONFormatter',
+        },
     },
     'handlers': {
         'null': {
@@ -325,8 +335,28 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple'
         },
+        # Audit events are written by a background thread as JSON lines,
+        # to AUDIT_LOG_FILE if set and to stderr otherwise.
+        'audit': {
+            'level': 'INFO',
+            'class': 'tunnistamo.audit_logging.AuditLogHandler',
+            'formatter': 'json',
+            'target': 'tunnistamo.audit_logging.BatchFileHandler' if env('AUDIT_LOG_FILE') else 'logging.StreamHandler',
+            'target_kwargs': {'filename': env('AUDIT_LOG_FILE')} if env('AUDIT_LOG_FILE') else {},
+        },
+        # Audit events are also saved as AuditEvent rows if AUDIT_LOG_DATABASE is set
+        'audit_database': {
+            'level': 'INFO',
+            'class': 'tunnistamo.audit_logging.AuditLogHandler',
+            'target': 'tunnistamo.audit_logging.DatabaseHandler',
+        },
     },
     'loggers': {
+        'tunnistamo.audit': {
+            'handlers': ['audit', 'audit_database'] if env('AUDIT_LOG_DATABASE') else ['audit'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django': {
             'handlers': ['console'],
             'level': 'WARNING',
@@ -428,6 +458,38 @@ CACHES = {
     'default': env.cache('CACHE_URL')
 }
 
+#
+# User login entries
+#
+USER_LOGIN_ENTRY_ASYNC = env('USER_LOGIN_ENTRY_ASYNC')
+# Maximum number of buffered entries, new entries are dropped when full
+USER_LOGIN_ENTRY_BUFFER_SIZE = 10000
+USER_LOGIN_ENTRY_BATCH_SIZE = 100
+# Seconds to wait for more entries before writing a partial batch
+USER_LOGIN_ENTRY_FLUSH_INTERVAL = 2
+# Seconds between logging the counts of buffered, dropped and written entries
+USER_LOGIN_ENTRY_STATS_LOG_INTERVAL = 300
+
+#
+# Audit log
+#
+# Audit events older than this many days are removed by the
+# delete_expired_audit_events management command
+AUDIT_EVENT_RETENTION_DAYS = 365
+
+#
+# Endpoint rate limiting
+#
+# Requests to paths matching `path` are limited to `rate` per `key`, where
+# key is one of 'client_id', 'user_or_ip' or 'ip'. Requires a shared cache
+# (see RATELIMIT_USE_CACHE).
+RATELIMIT_ENDPOINTS = [
+    {'path': r'^openid/token/?$', 'key': 'client_id', 'rate': '600/m', 'method': 'POST'},
+    {'path': r'^openid/authorize/?$', 'key': 'ip', 'rate': '120/m'},
+    {'path': r'^api-tokens/$', 'key': 'user_or_ip', 'rate': '300/m'},
+    {'path': r'^v1/', 'key': 'user_or_ip', 'rate': '600/m'},
+] if env('ENDPOINT_RATELIMIT_ENABLED') else []
+
 
 # Social Auth
 SOCIAL_AUTH_PIPELINE = (
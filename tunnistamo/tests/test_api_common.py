@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tunnistamo.api_common import get_token_cache_key
+from users.factories import access_token_factory
+
+LIST_URL = reverse('v1:userloginentry-list')
+
+
+@pytest.fixture
+def token():
+    return access_token_factory(scopes=['login_entries'])
+
+
+@pytest.fixture
+def api_client(token):
+    api_client = APIClient()
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(token.access_token))
+    return api_client
+
+
+@pytest.mark.django_db
+def test_validated_token_is_cached(api_client, token):
+    response = api_client.get(LIST_URL)
+    assert response.status_code == 200
+
+    cached = cache.get(get_token_cache_key(token.access_token))
+    assert cached['user_id'] == token.user_id
+    assert cached['scope'] == ['login_entries']
+
+
+@pytest.mark.django_db
+def test_deleted_token_is_removed_from_cache(api_client, token):
+    assert api_client.get(LIST_URL).status_code == 200
+
+    token.delete()
+
+    assert cache.get(get_token_cache_key(token.access_token)) is None
+    assert api_client.get(LIST_URL).status_code == 401
+
+
+@pytest.mark.django_db
+def test_saved_token_is_removed_from_cache(api_client, token):
+    assert api_client.get(LIST_URL).status_code == 200
+
+    token.expires_at = timezone.now() - timedelta(seconds=1)
+    token.save()
+
+    assert api_client.get(LIST_URL).status_code == 401
@@ -0,0 +1,71 @@
+import json
+import logging
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+
+from tunnistamo import auditlog
+from tunnistamo.audit_logging import AuditLogHandler, JSONFormatter
+from users.factories import OIDCClientFactory
+
+
+def make_record(message, **extra):
+    record = logging.LogRecord('tunnistamo.audit', logging.INFO, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_context():
+    data = json.loads(JSONFormatter().format(make_record('Token requested', event='token_retrieval')))
+
+    assert data['message'] == 'Token requested'
+    assert data['level'] == 'INFO'
+    assert data['event'] == 'token_retrieval'
+    assert 'msg' not in data
+
+
+def test_audit_log_handler_writes_batches_to_file(tmp_path, monkeypatch):
+    log_file = tmp_path / 'audit.log'
+    handler = AuditLogHandler(
+        target='tunnistamo.audit_logging.BatchFileHandler', target_kwargs={'filename': str(log_file)}
+    )
+    handler.setFormatter(JSONFormatter())
+    monkeypatch.setattr(handler, '_ensure_writer', lambda: None)
+
+    for i in range(3):
+        handler.handle(make_record('Event %s', event='test'))
+    handler.flush()
+    handler.close()
+
+    lines = log_file.read_text().splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0])['event'] == 'test'
+
+
+def test_audit_log_handler_drops_records_when_full(monkeypatch):
+    handler = AuditLogHandler(queue_size=1)
+    monkeypatch.setattr(handler, '_ensure_writer', lambda: None)
+
+    handler.handle(make_record('first'))
+    handler.handle(make_record('second'))
+
+    assert handler.dropped == 1
+
+
+@pytest.mark.django_db
+def test_log_authorize_uses_client_directory(django_assert_num_queries):
+    client = OIDCClientFactory(name='Test client')
+    request = RequestFactory().get('/openid/authorize', {'client_id': client.client_id})
+    request.user = AnonymousUser()
+
+    auditlog.log_authorize(request)
+    with django_assert_num_queries(0):
+        auditlog.log_authorize(request)
+
+    client.name = 'Renamed client'
+    client.save()
+    with mock.patch.object(auditlog.logger, 'info') as log_info:
+        auditlog.log_authorize(request)
+    assert log_info.call_args[1]['extra']['oidc_client_name'] == 'Renamed client'
@@ -0,0 +1,81 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+
+from tunnistamo.circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_breaker
+
+
+@pytest.fixture
+def breaker(settings):
+    settings.CIRCUIT_BREAKERS = {
+        'test-upstream': {'minimum_requests': 4, 'failure_rate': 0.5, 'open_timeout': 30, 'half_open_probes': 1},
+    }
+    return get_breaker('test-upstream')
+
+
+def breaker_opened_at(breaker):
+    return cache.get(breaker.state_key)
+
+
+def test_circuit_stays_closed_below_minimum_requests(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+
+    assert breaker.get_state() == CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_stays_closed_below_failure_rate(breaker):
+    for _ in range(3):
+        breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert breaker.get_state() == CLOSED
+
+
+def test_circuit_opens_at_failure_rate(breaker):
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert breaker.get_state() == OPEN
+    assert not breaker.is_available()
+    assert not breaker.allow_request()
+
+
+def test_half_open_circuit_lets_probes_through(breaker):
+    breaker.open()
+
+    with mock.patch('tunnistamo.circuit_breaker.time.time', return_value=breaker_opened_at(breaker) + 31):
+        assert breaker.get_state() == HALF_OPEN
+        assert breaker.is_available()
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_circuit(breaker):
+    breaker.open()
+
+    with mock.patch('tunnistamo.circuit_breaker.time.time', return_value=breaker_opened_at(breaker) + 31):
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.get_state() == CLOSED
+
+
+def test_failed_probe_opens_circuit_again(breaker):
+    breaker.open()
+
+    with mock.patch('tunnistamo.circuit_breaker.time.time', return_value=breaker_opened_at(breaker) + 31):
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.get_state() == OPEN
+
+
+def test_late_success_does_not_close_open_circuit(breaker):
+    breaker.open()
+    breaker.record_success()
+
+    assert breaker.get_state() == OPEN
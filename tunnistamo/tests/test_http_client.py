@@ -0,0 +1,156 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+import requests
+
+from tunnistamo.circuit_breaker import CLOSED, get_breaker
+from tunnistamo.http_client import CircuitOpenError, get_max_request_time, get_session
+
+
+def test_sessions_are_shared_per_upstream():
+    assert get_session('test-upstream') is get_session('test-upstream')
+    assert get_session('test-upstream') is not get_session('other-upstream')
+
+
+def test_default_timeout_is_applied():
+    session = get_session('test-upstream')
+    with mock.patch('requests.Session.send', return_value=mock.Mock(status_code=200)) as send:
+        session.get('http://example.com/')
+    assert send.call_args[1]['timeout'] == session.timeout
+
+    with mock.patch('requests.Session.send', return_value=mock.Mock(status_code=200)) as send:
+        session.get('http://example.com/', timeout=1)
+    assert send.call_args[1]['timeout'] == 1
+
+
+def test_upstream_settings(settings):
+    settings.HTTP_CLIENTS = {'configured-upstream': {'timeout': 5, 'pool_size': 3, 'retries': 0}}
+    session = get_session('configured-upstream')
+
+    assert session.timeout == 5
+    adapter = session.get_adapter('https://example.com/')
+    assert adapter._pool_maxsize == 3
+    assert adapter.max_retries.total == 0
+
+
+def test_outcomes_are_recorded_in_circuit_breaker():
+    session = get_session('test-upstream')
+
+    with mock.patch('tunnistamo.circuit_breaker.CircuitBreaker.record_success') as record_success, \
+            mock.patch('tunnistamo.circuit_breaker.CircuitBreaker.record_failure') as record_failure:
+        with mock.patch('requests.Session.send', return_value=mock.Mock(status_code=401)):
+            session.get('http://example.com/')
+        assert record_success.call_count == 1
+
+        with mock.patch('requests.Session.send', return_value=mock.Mock(status_code=503)):
+            session.get('http://example.com/')
+        assert record_failure.call_count == 1
+
+        with mock.patch('requests.Session.send', side_effect=requests.ConnectionError):
+            with pytest.raises(requests.ConnectionError):
+                session.get('http://example.com/')
+        assert record_failure.call_count == 2
+
+
+def test_failures_open_circuit(settings):
+    settings.CIRCUIT_BREAKERS = {'failing-upstream': {'minimum_requests': 2}}
+    session = get_session('failing-upstream')
+
+    with mock.patch('requests.Session.send', side_effect=requests.ConnectTimeout):
+        for _ in range(2):
+            with pytest.raises(requests.ConnectTimeout):
+                session.get('http://example.com/')
+
+    assert not get_breaker('failing-upstream').allow_request()
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.received_cookies.append(self.headers.get('Cookie'))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'CGISESSID=user-1-session; Path=/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def cookie_server():
+    server = HTTPServer(('127.0.0.1', 0), CookieHandler)
+    server.received_cookies = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_upstream_cookies_are_not_sent_back(cookie_server):
+    session = get_session('cookie-upstream')
+    url = 'http://127.0.0.1:%d/' % cookie_server.server_address[1]
+
+    session.get(url)
+    session.get(url)
+
+    assert cookie_server.received_cookies == [None, None]
+    assert len(session.cookies) == 0
+
+
+def test_max_request_time(settings):
+    settings.HTTP_CLIENTS = {
+        'slow-upstream': {'timeout': (3, 20), 'retries': 2, 'backoff_factor': 0.5},
+        'fast-upstream': {'timeout': 1, 'retries': 0},
+    }
+
+    # Three attempts and backoffs of 0.5 and 1 seconds between them
+    assert get_max_request_time('slow-upstream') == pytest.approx(3 * 23 + 1.5)
+    assert get_max_request_time('fast-upstream') == 1
+
+
+def test_request_is_not_made_while_circuit_is_open():
+    session = get_session('open-upstream')
+    session.breaker.open()
+
+    with mock.patch('requests.Session.send') as send:
+        with pytest.raises(CircuitOpenError):
+            session.get('http://example.com/')
+    assert not send.called
+
+
+def test_half_open_probe_is_taken_by_request(settings):
+    settings.CIRCUIT_BREAKERS = {'half-open-upstream': {'open_timeout': 30, 'half_open_probes': 1}}
+    session = get_session('half-open-upstream')
+    breaker = get_breaker('half-open-upstream')
+    breaker.open()
+
+    with mock.patch('tunnistamo.circuit_breaker.time.time', return_value=time.time() + 31):
+        # Checking the availability before a login doesn't use up the probe
+        assert breaker.is_available()
+        assert breaker.is_available()
+
+        with mock.patch('requests.Session.send', return_value=mock.Mock(status_code=200)) as send:
+            session.get('http://example.com/')
+        assert send.call_count == 1
+
+    assert breaker.get_state() == CLOSED
+
+
+def test_only_one_probe_is_made_while_half_open(settings):
+    settings.CIRCUIT_BREAKERS = {'probed-upstream': {'open_timeout': 30, 'half_open_probes': 1}}
+    session = get_session('probed-upstream')
+    breaker = get_breaker('probed-upstream')
+    breaker.open()
+
+    with mock.patch('tunnistamo.circuit_breaker.time.time', return_value=time.time() + 31):
+        # Another request is probing the upstream
+        assert breaker.allow_request()
+
+        with mock.patch('requests.Session.send') as send:
+            with pytest.raises(CircuitOpenError):
+                session.get('http://example.com/')
+        assert not send.called
@@ -0,0 +1,278 @@
+import os
+import tempfile
+from unittest import mock
+
+import pytest
+from django.core.cache import caches
+from django.test import RequestFactory, override_settings
+
+RATELIMIT_CACHES = {
+    'cache': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'tunnistamo-ratelimit-engine-tests'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15'),
+    },
+}
+
+RATE = '2/m'
+PERIOD = 60
+
+
+@pytest.fixture
+def ratelimit():
+    with override_settings(CACHES={'default': RATELIMIT_CACHES['cache']}):
+        from tunnistamo import ratelimit
+    return ratelimit
+
+
+@pytest.fixture(params=['cache', 'redis'])
+def engine(request, ratelimit, monkeypatch):
+    ratelimit_settings = override_settings(
+        CACHES={'default': RATELIMIT_CACHES['cache'], 'ratelimit': RATELIMIT_CACHES[request.param]},
+        RATELIMIT_USE_CACHE='ratelimit',
+    )
+    with ratelimit_settings:
+        if request.param == 'redis':
+            from redis.exceptions import ConnectionError
+
+            engine = ratelimit.RedisEngine(caches['ratelimit'])
+            try:
+                engine.client.ping()
+            except ConnectionError:
+                pytest.skip('Redis is not available')
+        else:
+            engine = ratelimit.CacheEngine(caches['ratelimit'])
+
+        caches['ratelimit'].clear()
+        monkeypatch.setattr(ratelimit, '_engine', engine)
+        monkeypatch.setattr(ratelimit, 'known_limited', ratelimit.KnownLimited())
+        yield engine
+
+
+@pytest.fixture
+def clock(ratelimit):
+    """Frozen time at the start of the rate limit window of the test key"""
+    class Clock:
+        now = ratelimit._get_window('127.0.0.1', PERIOD) + 1
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    clock = Clock()
+    with mock.patch('tunnistamo.ratelimit.time.time', side_effect=lambda: clock.now):
+        yield clock
+
+
+def hit(ratelimit, algorithm=None, increment=True, reset=False):
+    request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+    return ratelimit.get_usage(request, group='test', key='ip', rate=RATE, increment=increment, reset=reset,
+                               algorithm=algorithm)
+
+
+def test_fixed_window_counts_hits(ratelimit, engine, clock):
+    assert hit(ratelimit)['count'] == 1
+    assert not hit(ratelimit)['should_limit']
+
+    usage = hit(ratelimit)
+    assert usage['count'] == 3
+    assert usage['should_limit']
+    assert usage['time_left'] == PERIOD - 1
+
+
+def test_fixed_window_check_without_increment_does_not_count(ratelimit, engine, clock):
+    hit(ratelimit)
+
+    assert hit(ratelimit, increment=False)['count'] == 1
+    assert hit(ratelimit, increment=False)['count'] == 1
+
+
+def test_fixed_window_is_reset_in_next_window(ratelimit, engine, clock):
+    for i in range(3):
+        hit(ratelimit)
+
+    clock.advance(PERIOD)
+    usage = hit(ratelimit)
+    assert usage['count'] == 1
+    assert not usage['should_limit']
+
+
+@pytest.mark.parametrize('algorithm', ['fixed-window', 'sliding-window', 'token-bucket'])
+def test_reset_clears_limit(ratelimit, engine, clock, algorithm):
+    for i in range(3):
+        hit(ratelimit, algorithm)
+
+    hit(ratelimit, algorithm, reset=True)
+
+    usage = hit(ratelimit, algorithm)
+    assert usage['count'] == 1
+    assert not usage['should_limit']
+
+
+def test_limited_key_is_remembered_until_window_expires(ratelimit, engine, clock):
+    for i in range(3):
+        hit(ratelimit)
+
+    with mock.patch.object(engine, 'fixed_window') as fixed_window:
+        usage = hit(ratelimit)
+        assert usage['should_limit']
+        assert usage['time_left'] == PERIOD - 1
+        assert not fixed_window.called
+
+        clock.advance(PERIOD - 2)
+        assert hit(ratelimit)['time_left'] == 1
+        assert not fixed_window.called
+
+    clock.advance(2)
+    usage = hit(ratelimit)
+    assert usage['count'] == 1
+    assert not usage['should_limit']
+
+
+def test_reset_only_clears_known_limited_entry_of_current_process(ratelimit, engine, clock):
+    for i in range(3):
+        usage = hit(ratelimit)
+    cache_key = ratelimit._get_cache_keys(
+        ratelimit.FIXED_WINDOW, 'test', clock.now + PERIOD - 1, RATE, '127.0.0.1', ratelimit.ALL, PERIOD
+    )[0]
+    other_process_known_limited = ratelimit.KnownLimited()
+    other_process_known_limited.add(cache_key, usage)
+
+    hit(ratelimit, reset=True)
+
+    assert ratelimit.known_limited.get(cache_key) is None
+    assert other_process_known_limited.get(cache_key)['should_limit']
+
+
+def test_sliding_window_weighs_previous_window(ratelimit, engine, clock):
+    algorithm = ratelimit.SLIDING_WINDOW
+    for i in range(2):
+        hit(ratelimit, algorithm)
+
+    # Right after the window boundary the previous window still counts almost fully
+    clock.advance(PERIOD)
+    assert hit(ratelimit, algorithm, increment=False)['count'] == 1
+    usage = hit(ratelimit, algorithm)
+    assert usage['count'] == 2
+    assert not usage['should_limit']
+    assert hit(ratelimit, algorithm)['should_limit']
+
+
+def test_sliding_window_previous_window_is_forgotten_by_end_of_window(ratelimit, engine, clock):
+    algorithm = ratelimit.SLIDING_WINDOW
+    for i in range(2):
+        hit(ratelimit, algorithm)
+
+    clock.advance(2 * PERIOD - 2)
+    assert hit(ratelimit, algorithm, increment=False)['count'] == 0
+    assert not hit(ratelimit, algorithm)['should_limit']
+    assert not hit(ratelimit, algorithm)['should_limit']
+    assert hit(ratelimit, algorithm)['should_limit']
+
+
+def test_token_bucket_allows_burst_up_to_limit(ratelimit, engine, clock):
+    algorithm = ratelimit.TOKEN_BUCKET
+    assert not hit(ratelimit, algorithm)['should_limit']
+    assert not hit(ratelimit, algorithm)['should_limit']
+
+    usage = hit(ratelimit, algorithm)
+    assert usage['should_limit']
+    # A denied request uses up the next token as well
+    assert usage['time_left'] == PERIOD
+
+
+def test_token_bucket_refills_over_time(ratelimit, engine, clock):
+    algorithm = ratelimit.TOKEN_BUCKET
+    for i in range(2):
+        hit(ratelimit, algorithm)
+
+    # One token is added in half of the period
+    clock.advance(PERIOD // 2)
+    assert hit(ratelimit, algorithm, increment=False)['count'] == 1
+    assert not hit(ratelimit, algorithm)['should_limit']
+    assert hit(ratelimit, algorithm)['should_limit']
+
+
+def test_token_bucket_denies_request_before_token_is_refilled(ratelimit, engine, clock):
+    algorithm = ratelimit.TOKEN_BUCKET
+    for i in range(2):
+        hit(ratelimit, algorithm)
+
+    clock.advance(PERIOD // 2 - 1)
+    assert hit(ratelimit, algorithm)['should_limit']
+
+
+def test_token_bucket_does_not_refill_over_limit(ratelimit, engine, clock):
+    algorithm = ratelimit.TOKEN_BUCKET
+    hit(ratelimit, algorithm)
+
+    clock.advance(10 * PERIOD)
+    assert hit(ratelimit, algorithm, increment=False)['count'] == 0
+    for i in range(2):
+        assert not hit(ratelimit, algorithm)['should_limit']
+    assert hit(ratelimit, algorithm)['should_limit']
+
+
+def test_get_stats(ratelimit, engine, clock):
+    for i in range(3):
+        hit(ratelimit)
+    hit(ratelimit)
+
+    assert ratelimit.get_stats() == {
+        'local_hits': 1,
+        'remote_checks': 3,
+        'fail_open': 0,
+        'limited_keys': 1,
+    }
+
+
+def test_get_stats_counts_fail_open(ratelimit, engine, clock, settings):
+    settings.RATELIMIT_FAIL_OPEN = True
+
+    with mock.patch.object(engine, 'fixed_window', return_value=None):
+        assert hit(ratelimit) is None
+
+    assert ratelimit.get_stats()['fail_open'] == 1
+    assert ratelimit.get_stats()['limited_keys'] == 0
+
+
+@pytest.fixture
+def unavailable_redis_engine(ratelimit, monkeypatch):
+    from redis.exceptions import ConnectionError
+
+    ratelimit_settings = override_settings(
+        CACHES={'default': RATELIMIT_CACHES['cache'], 'ratelimit': RATELIMIT_CACHES['redis']},
+        RATELIMIT_USE_CACHE='ratelimit',
+    )
+    with ratelimit_settings:
+        engine = ratelimit.RedisEngine(caches['ratelimit'])
+        for script in ('_fixed_window', '_sliding_window', '_token_bucket'):
+            monkeypatch.setattr(engine, script, mock.Mock(side_effect=ConnectionError))
+        monkeypatch.setattr(engine.client, 'delete', mock.Mock(side_effect=ConnectionError))
+        monkeypatch.setattr(ratelimit, '_engine', engine)
+        monkeypatch.setattr(ratelimit, 'known_limited', ratelimit.KnownLimited())
+        yield engine
+
+
+@pytest.mark.parametrize('algorithm', ['fixed-window', 'sliding-window', 'token-bucket'])
+def test_redis_errors_fail_closed(ratelimit, unavailable_redis_engine, algorithm):
+    usage = hit(ratelimit, algorithm)
+
+    assert usage['should_limit']
+    assert usage['limit'] == 0
+
+
+@pytest.mark.parametrize('algorithm', ['fixed-window', 'sliding-window', 'token-bucket'])
+def test_redis_errors_fail_open(ratelimit, unavailable_redis_engine, settings, algorithm):
+    settings.RATELIMIT_FAIL_OPEN = True
+
+    assert hit(ratelimit, algorithm) is None
+    assert ratelimit.get_stats()['fail_open'] == 1
+
+
+def test_redis_errors_are_ignored_on_reset(ratelimit, unavailable_redis_engine):
+    hit(ratelimit, reset=True)
+
+    assert unavailable_redis_engine.client.delete.called
@@ -0,0 +1,123 @@
+import os
+import tempfile
+
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+from django.utils.crypto import get_random_string
+
+from tunnistamo.api_common import get_token_data
+from tunnistamo.auditlog import client_names
+from users.factories import OIDCClientFactory, access_token_factory
+
+RATELIMIT_SETTINGS = dict(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(), 'tunnistamo-ratelimit-tests'),
+        },
+    },
+    RATELIMIT_USE_CACHE='ratelimit',
+    RATELIMIT_ENDPOINTS=[
+        {'path': r'^openid/token/?$', 'key': 'client_id', 'rate': '2/m', 'method': 'POST'},
+        {'path': r'^v1/', 'key': 'user_or_ip', 'rate': '2/m'},
+    ],
+)
+
+USER_LOGIN_ENTRY_URL = '/v1/user_login_entry/'
+
+
+@pytest.fixture(autouse=True)
+def ratelimit_settings(monkeypatch):
+    with override_settings(**RATELIMIT_SETTINGS):
+        from tunnistamo import ratelimit
+
+        # The cache and the engine are bound when the module is first
+        # imported, which might have happened with other settings
+        monkeypatch.setattr(ratelimit, 'ratelimit_cache', caches['ratelimit'])
+        monkeypatch.setattr(ratelimit, '_engine', None)
+        assert ratelimit.get_engine().cache is caches['ratelimit']
+
+        caches['ratelimit'].clear()
+        ratelimit.known_limited.clear()
+        yield
+
+
+def exhaust_limit(request):
+    for remaining in (1, 0):
+        response = request()
+        assert response.status_code != 429
+        assert response['X-RateLimit-Limit'] == '2'
+        assert response['X-RateLimit-Remaining'] == str(remaining)
+
+    response = request()
+    assert response.status_code == 429
+    assert int(response['Retry-After']) > 0
+
+
+@pytest.mark.django_db
+def test_token_endpoint_is_rate_limited_by_client_id(client):
+    OIDCClientFactory(client_id='client')
+    OIDCClientFactory(client_id='other-client')
+    # Loaded by e.g. the audit logging of earlier requests
+    client_names.get()
+
+    exhaust_limit(lambda: client.post('/openid/token/', {'client_id': 'client'}))
+
+    response = client.post('/openid/token/', {'client_id': 'other-client'})
+    assert response.status_code != 429
+
+
+@pytest.mark.django_db
+def test_unknown_client_ids_share_ip_limit(client):
+    client_ids = iter('unknown-client-%d' % i for i in range(3))
+
+    exhaust_limit(lambda: client.post('/openid/token/', {'client_id': next(client_ids)}))
+
+
+@pytest.mark.django_db
+def test_client_id_key_does_not_query_database(client, django_assert_num_queries):
+    client_ids = iter('unknown-client-%d' % i for i in range(3))
+    exhaust_limit(lambda: client.post('/openid/token/', {'client_id': next(client_ids)}))
+
+    with django_assert_num_queries(0):
+        response = client.post('/openid/token/', {'client_id': 'client-%s' % get_random_string()})
+    assert response.status_code == 429
+
+
+@pytest.mark.django_db
+def test_invalid_bearer_tokens_share_ip_limit(client):
+    tokens = iter('invalid-token-%d' % i for i in range(3))
+
+    exhaust_limit(lambda: client.get(USER_LOGIN_ENTRY_URL, HTTP_AUTHORIZATION='Bearer %s' % next(tokens)))
+
+
+@pytest.mark.django_db
+def test_valid_bearer_token_is_rate_limited_by_user(client):
+    token = access_token_factory(scopes=['login_entries'])
+    # Cached when the token was used for authentication earlier
+    get_token_data(token.access_token)
+
+    exhaust_limit(lambda: client.get(USER_LOGIN_ENTRY_URL, HTTP_AUTHORIZATION='Bearer %s' % token.access_token))
+
+    # Requests of other users from the same address are not limited
+    response = client.get(USER_LOGIN_ENTRY_URL)
+    assert response.status_code != 429
+
+
+@pytest.mark.django_db
+def test_bearer_token_key_does_not_query_database(client, django_assert_num_queries):
+    tokens = iter('invalid-token-%d' % i for i in range(3))
+    exhaust_limit(lambda: client.get(USER_LOGIN_ENTRY_URL, HTTP_AUTHORIZATION='Bearer %s' % next(tokens)))
+
+    with django_assert_num_queries(0):
+        response = client.get(USER_LOGIN_ENTRY_URL, HTTP_AUTHORIZATION='Bearer %s' % get_random_string())
+    assert response.status_code == 429
+
+
+@pytest.mark.django_db
+def test_other_endpoints_are_not_rate_limited(client):
+    for i in range(3):
+        response = client.get('/openid/token/')
+        assert 'X-RateLimit-Limit' not in response
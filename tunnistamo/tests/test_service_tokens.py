@@ -0,0 +1,84 @@
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+
+from tunnistamo.service_tokens import ServiceToken, _get_local_lock
+
+
+def make_service_token(expires_in=3600, **kwargs):
+    tokens = iter('token-%d' % i for i in range(1, 10))
+    fetch = mock.Mock(side_effect=lambda: (next(tokens), expires_in))
+    return ServiceToken('test_service_token', fetch, **kwargs), fetch
+
+
+def test_token_is_cached():
+    service_token, fetch = make_service_token()
+
+    assert service_token.get() == 'token-1'
+    assert service_token.get() == 'token-1'
+    assert fetch.call_count == 1
+
+
+def test_token_is_refreshed_before_expiry():
+    service_token, fetch = make_service_token(refresh_margin=60)
+
+    with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000):
+        assert service_token.get() == 'token-1'
+    with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000 + 3600 - 59):
+        assert service_token.get() == 'token-2'
+    assert fetch.call_count == 2
+
+
+def test_valid_token_is_used_while_another_worker_refreshes():
+    service_token, fetch = make_service_token(refresh_margin=60)
+
+    with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000):
+        service_token.get()
+    cache.set(service_token.lock_key, 1)
+    with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000 + 3600 - 59):
+        assert service_token.get() == 'token-1'
+    assert fetch.call_count == 1
+
+
+def test_valid_token_is_used_while_another_thread_refreshes():
+    service_token, fetch = make_service_token(refresh_margin=60)
+
+    with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000):
+        service_token.get()
+    tokens = []
+    with _get_local_lock(service_token.cache_key):
+        with mock.patch('tunnistamo.service_tokens.time.time', return_value=1000 + 3600 - 59):
+            thread = threading.Thread(target=lambda: tokens.append(service_token.get()))
+            thread.start()
+            thread.join(timeout=1)
+    assert tokens == ['token-1']
+    assert fetch.call_count == 1
+
+
+def test_invalidated_token_is_fetched_again():
+    service_token, fetch = make_service_token()
+
+    token = service_token.get()
+    service_token.invalidate('some-other-token')
+    assert service_token.get() == token
+
+    service_token.invalidate(token)
+    assert service_token.get() == 'token-2'
+    assert fetch.call_count == 2
+
+
+def test_token_without_lifetime_is_not_cached():
+    service_token, fetch = make_service_token(expires_in=0)
+
+    assert service_token.get() == 'token-1'
+    assert service_token.get() == 'token-2'
+
+
+def test_lock_is_held_longer_than_upstream_requests_can_take(settings):
+    settings.HTTP_CLIENTS = {'slow-upstream': {'timeout': (3.05, 20), 'retries': 2}}
+
+    service_token = ServiceToken('test_service_token', mock.Mock(), upstream='slow-upstream')
+
+    assert service_token.lock_timeout > 3 * 23.05
+    assert ServiceToken('test_service_token', mock.Mock(), upstream='slow-upstream', lock_timeout=1).lock_timeout == 1
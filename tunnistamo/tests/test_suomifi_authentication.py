@@ -2,18 +2,21 @@ import json
 import os
 from base64 import b64encode
 from datetime import timedelta
+from unittest import mock
 from urllib.parse import parse_qs, urlencode, urlparse
 
 import pytest
 from django.conf import settings
 from django.core.management import call_command
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
 from freezegun import freeze_time
 from oidc_provider.models import Client, Token
 from onelogin.saml2.utils import OneLogin_Saml2_Utils as SAMLUtils
 from social_django.models import UserSocialAuth
 
+from auth_backends.suomifi import SuomiFiSAMLAuth
+from oidc_apis.scopes import SuomiFiUserAttributeScopeClaims
 from users.models import Application, LoginMethod, OidcClientOptions
 from users.views import LoginView
 
@@ -150,6 +153,72 @@ def test_suomifi_metadata(django_client):
     assert metadata_response.content == expected_metadata
 
 
+def count_metadata_generation():
+    return mock.patch.object(
+        SuomiFiSAMLAuth, 'generate_metadata_xml', autospec=True,
+        side_effect=SuomiFiSAMLAuth.generate_metadata_xml,
+    )
+
+
+@pytest.mark.django_db
+def test_suomifi_metadata_is_cached(django_client):
+    metadata_url = reverse('auth_backends:saml_metadata', kwargs={'backend': 'suomifi'})
+
+    with count_metadata_generation() as generate_metadata_xml:
+        first_response = django_client.get(metadata_url)
+        second_response = django_client.get(metadata_url)
+
+    assert generate_metadata_xml.call_count == 1
+    assert first_response.status_code == second_response.status_code == 200
+    assert first_response.content == second_response.content
+    assert first_response['ETag'] == second_response['ETag']
+    assert first_response['Last-Modified'] == second_response['Last-Modified']
+
+
+@pytest.mark.django_db
+def test_suomifi_metadata_is_regenerated_when_settings_change(django_client, settings):
+    metadata_url = reverse('auth_backends:saml_metadata', kwargs={'backend': 'suomifi'})
+
+    with count_metadata_generation() as generate_metadata_xml:
+        django_client.get(metadata_url)
+        settings.SOCIAL_AUTH_SUOMIFI_UI_LOGO = {
+            'url': 'https://tunnistamo.test/logo.png',
+            'height': '40',
+            'width': '40',
+        }
+        response = django_client.get(metadata_url)
+
+    assert generate_metadata_xml.call_count == 2
+    assert b'https://tunnistamo.test/logo.png' in response.content
+
+
+@pytest.mark.django_db
+def test_suomifi_metadata_conditional_get(django_client):
+    metadata_url = reverse('auth_backends:saml_metadata', kwargs={'backend': 'suomifi'})
+    response = django_client.get(metadata_url)
+
+    response = django_client.get(metadata_url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+    assert response.content == b''
+
+    response = django_client.get(metadata_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+    assert response.status_code == 304
+
+    response = django_client.get(metadata_url, HTTP_IF_NONE_MATCH='"outdated"')
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_render_saml_metadata_command(django_client):
+    call_command('render_saml_metadata', 'suomifi', '--base-url', 'http://%s' % SERVER_NAME)
+
+    with count_metadata_generation() as generate_metadata_xml:
+        response = django_client.get(reverse('auth_backends:saml_metadata', kwargs={'backend': 'suomifi'}))
+
+    assert response.status_code == 200
+    assert generate_metadata_xml.call_count == 0
+
+
 @pytest.mark.django_db
 @freeze_time('2019-01-01 12:00:00', tz_offset=2)
 def test_suomifi_login_request(django_client, fixed_saml_id):
@@ -438,3 +507,15 @@ def test_suomifi_scopes(django_client):
     scopes = {r['id']: r for r in scopes_content['results']}
     assert 'suomifi_basic' in scopes
     assert 'suomifi_extended' in scopes
+
+
+@pytest.mark.django_db
+def test_suomifi_access_levels_are_served_from_memory(django_assert_num_queries):
+    populate_suomifi_attributes()
+    dir(SuomiFiUserAttributeScopeClaims)
+
+    with django_assert_num_queries(0):
+        with translation.override('fi'):
+            info = SuomiFiUserAttributeScopeClaims.info_suomifi_basic
+        assert info == ('Basic attributes', 'Limited set of attributes')
+        assert 'info_suomifi_extended' in dir(SuomiFiUserAttributeScopeClaims)
@@ -21,7 +21,7 @@ from scopes.api import ScopeListView
 from services.api import ServiceViewSet
 from services.views import ReportView
 from tunnistamo import social_auth_urls
-from users.api import TunnistamoAuthorizationView, UserConsentViewSet, UserLoginEntryViewSet
+from users.api import AuditEventViewSet, TunnistamoAuthorizationView, UserConsentViewSet, UserLoginEntryViewSet
 from users.views import (
     LoginView, LogoutView, TunnistamoOidcAuthorizeView, TunnistamoOidcEndSessionView,
     TunnistamoOidcTokenView, RememberMeView, show_profile
@@ -42,6 +42,7 @@ router.register('user_device', UserDeviceViewSet)
 router.register('user_login_entry', UserLoginEntryViewSet)
 router.register('service', ServiceViewSet)
 router.register('user_consent', UserConsentViewSet)
+router.register('audit_event', AuditEventViewSet)
 
 v1_scope_path = path('scope/', ScopeListView.as_view(), name='scope-list')
 v1_api_path = path('v1/', include((router.urls + [v1_scope_path], 'v1')))
@@ -1,6 +1,10 @@
+import threading
+import uuid
 from collections import OrderedDict
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -123,3 +127,52 @@ class TranslatableSerializer(serializers.Serializer):
 
 def assert_objects_in_response(response, objects):
     assert {r['id'] for r in response.data['results']} == {o.id for o in objects}
+
+
+class VersionedValue:
+    """A per-process copy of a value loaded with `loader`.
+
+    A version stamp in the shared cache tells when the copy is out of date,
+    so that all processes reload the value lazily after `invalidate()`.
+    """
+
+    def __init__(self, cache_key, loader):
+        self.cache_key = cache_key
+        self.loader = loader
+        self._version = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def _bump_version(self):
+        cache.set(self.cache_key, uuid.uuid4().hex, None)
+
+    def invalidate(self):
+        self._bump_version()
+        # Bump again after commit so that no process keeps a copy loaded
+        # before the changes were visible to it.
+        transaction.on_commit(self._bump_version)
+
+    def get_version(self):
+        """Return the current version stamp of the value"""
+        version = cache.get(self.cache_key)
+        if version is None:
+            cache.add(self.cache_key, uuid.uuid4().hex, None)
+            version = cache.get(self.cache_key)
+        return version
+
+    def get(self):
+        version = self.get_version()
+        if version is None or version != self._version:
+            with self._lock:
+                self._value = self.loader()
+                self._version = version
+
+        return self._value
+
+    def peek(self):
+        """Return the current per-process copy, or None if it hasn't been loaded
+
+        Neither the version nor the database is consulted, so the copy might
+        be out of date.
+        """
+        return self._value
@@ -4,17 +4,19 @@ import coreapi
 import coreschema
 from django.contrib.auth import logout as django_user_logout
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django_filters import rest_framework as django_filters
 from oauth2_provider.models import get_application_model
 from oauth2_provider.views import AuthorizationView
 from oidc_provider.models import UserConsent
 from rest_framework import filters, mixins, serializers, viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.schemas import AutoSchema
 
 from scopes.api import ScopeDataBuilder
 from tunnistamo.api_common import OidcTokenAuthentication, ScopePermission
-from tunnistamo.pagination import DefaultPagination
-from users.models import UserLoginEntry
+from tunnistamo.pagination import DefaultPagination, KeysetPagination
+from users.models import AuditEvent, UserLoginEntry
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +47,39 @@ class UserLoginEntryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         return self.queryset.filter(user_id=self.request.user.id)
 
 
+class AuditEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuditEvent
+        fields = ('id', 'timestamp', 'event', 'message', 'user_uuid', 'user_identifier', 'user_ip', 'data')
+
+
+class AuditEventFilter(django_filters.FilterSet):
+    since = django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='gte')
+    until = django_filters.IsoDateTimeFilter(field_name='timestamp', lookup_expr='lt')
+
+    class Meta:
+        model = AuditEvent
+        fields = ('event', 'user_uuid', 'user_identifier')
+
+
+class AuditEventViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    List audit events. Only available to admin users logged in to Tunnistamo.
+
+    list:
+    Return audit events, newest first.
+    """
+    serializer_class = AuditEventSerializer
+    queryset = AuditEvent.objects.all()
+    pagination_class = KeysetPagination
+    # Not available with access tokens, which any client could have been
+    # issued for an admin user
+    authentication_classes = (SessionAuthentication,)
+    permission_classes = (IsAdminUser,)
+    filter_backends = (django_filters.DjangoFilterBackend,)
+    filterset_class = AuditEventFilter
+
+
 class UserConsentSerializer(serializers.ModelSerializer):
     service = serializers.SerializerMethodField()
     scopes = serializers.SerializerMethodField()
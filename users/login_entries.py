@@ -0,0 +1,172 @@
+"""
+Buffered writing of user login entries.
+
+When USER_LOGIN_ENTRY_ASYNC is enabled, login entries are put into a bounded
+in-process queue and written by a background thread in batches. Geo location
+lookups are done by the writer thread, so they don't add to the latency of
+token issuance. If the queue is full, new entries are dropped and counted.
+The counts are logged periodically by the writer thread.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+from ipware import get_client_ip
+
+from users.models import UserLoginEntry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 2
+DEFAULT_STATS_LOG_INTERVAL = 300
+
+
+class LoginEntryBuffer:
+    def __init__(self, max_size=DEFAULT_BUFFER_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, stats_log_interval=DEFAULT_STATS_LOG_INTERVAL):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats_log_interval = stats_log_interval
+        self._stats_logged_at = time.monotonic()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written': 0,
+            'failed': 0,
+        }
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def put(self, entry):
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self._count('dropped')
+            logger.warning('Login entry buffer is full, dropping login entry of user %s', entry.user_id)
+            return False
+        self._count('enqueued')
+        return True
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['buffered'] = self.queue.qsize()
+        return stats
+
+    def flush(self):
+        """Write all currently buffered entries. Returns the number written."""
+        written = 0
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _ensure_writer(self):
+        # The writer is started lazily and restarted in forked worker processes
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='login-entry-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _take_batch(self, block=True):
+        batch = []
+        try:
+            batch.append(self.queue.get(block=block, timeout=self.flush_interval if block else None))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        for entry in batch:
+            if entry.geo_location is None:
+                entry.geo_location = UserLoginEntry.objects.get_geo_location(entry.ip_address)
+        try:
+            with transaction.atomic():
+                UserLoginEntry.objects.bulk_create(batch)
+        except Exception:
+            # E.g. the user or the service of an entry was deleted meanwhile.
+            # Write the entries one by one, so that only the bad ones are lost.
+            logger.warning('Writing %d login entries failed, retrying one by one', len(batch), exc_info=True)
+            return sum(self._write_one(entry) for entry in batch)
+        self._count('written', len(batch))
+        return len(batch)
+
+    def _write_one(self, entry):
+        try:
+            with transaction.atomic():
+                entry.save(force_insert=True)
+        except Exception:
+            self._count('failed')
+            logger.exception('Writing the login entry of user %s failed', entry.user_id)
+            return 0
+        self._count('written')
+        return 1
+
+    def log_stats(self):
+        logger.info(
+            'Login entries: %(enqueued)d enqueued, %(dropped)d dropped, %(written)d written, '
+            '%(failed)d failed, %(buffered)d buffered',
+            self.get_stats(),
+        )
+        self._stats_logged_at = time.monotonic()
+
+    def _log_stats_if_due(self):
+        if time.monotonic() - self._stats_logged_at >= self.stats_log_interval:
+            self.log_stats()
+
+    def _run(self):
+        while True:
+            self._log_stats_if_due()
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            finally:
+                connection.close()
+
+
+login_entry_buffer = LoginEntryBuffer(
+    max_size=getattr(settings, 'USER_LOGIN_ENTRY_BUFFER_SIZE', DEFAULT_BUFFER_SIZE),
+    batch_size=getattr(settings, 'USER_LOGIN_ENTRY_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+    flush_interval=getattr(settings, 'USER_LOGIN_ENTRY_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+    stats_log_interval=getattr(settings, 'USER_LOGIN_ENTRY_STATS_LOG_INTERVAL', DEFAULT_STATS_LOG_INTERVAL),
+)
+atexit.register(login_entry_buffer.flush)
+
+
+def record_login_entry(request, service, user):
+    if not getattr(settings, 'USER_LOGIN_ENTRY_ASYNC', False):
+        return UserLoginEntry.objects.create_from_request(request, service, user=user)
+
+    entry = UserLoginEntry(
+        user_id=user.pk,
+        service_id=service.pk,
+        timestamp=now(),
+        ip_address=get_client_ip(request)[0],
+    )
+    # The token might still be rolled back
+    transaction.on_commit(lambda: login_entry_buffer.put(entry))
+    return entry
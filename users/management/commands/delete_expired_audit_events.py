@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from users.models import AuditEvent
+
+
+class Command(BaseCommand):
+    help = "Delete audit events older than AUDIT_EVENT_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.AUDIT_EVENT_RETENTION_DAYS,
+                            help="Retention period in days")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Number of ids to delete at a time")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        # The expired events are deleted in primary key ranges to keep the
+        # transactions short. Ids don't strictly follow timestamps (e.g. with
+        # concurrent writers), so each batch is filtered by the cutoff too.
+        bounds = AuditEvent.objects.filter(timestamp__lt=cutoff).aggregate(first=Min('id'), last=Max('id'))
+        if bounds['last'] is None:
+            self.stdout.write("No expired audit events")
+            return
+
+        deleted = 0
+        start = bounds['first']
+        while start <= bounds['last']:
+            end = min(start + options["batch_size"], bounds['last'] + 1)
+            count, _ = AuditEvent.objects.filter(id__gte=start, id__lt=end, timestamp__lt=cutoff).delete()
+            deleted += count
+            start = end
+
+        self.stdout.write("Deleted {} audit events older than {}".format(deleted, cutoff.isoformat()))
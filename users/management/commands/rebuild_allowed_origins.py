@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from users.models import AllowedOrigin
+from users.signals import rebuild_allowed_origins
+
+
+class Command(BaseCommand):
+    help = "Rebuild the allowed CORS origins from all client configurations"
+
+    def handle(self, *args, **options):
+        rebuild_allowed_origins()
+        self.stdout.write("Rebuilt {} allowed origins".format(AllowedOrigin.objects.count()))
@@ -1,5 +1,7 @@
 from corsheaders.middleware import CorsMiddleware
 
+from tunnistamo.utils import VersionedValue
+
 from .models import AllowedOrigin
 from .utils import generate_origin
 
@@ -13,14 +15,27 @@ CORS_HEADERS = [
 ]
 
 
+def _load_allowed_origins():
+    return frozenset(AllowedOrigin.objects.values_list('key', flat=True))
+
+
+# Per-process copy of the AllowedOrigin keys
+allowed_origins = VersionedValue('allowed-origins-version', _load_allowed_origins)
+
+
+def invalidate_allowed_origins():
+    """Make all processes reload the allowed origins on their next check."""
+    allowed_origins.invalidate()
+
+
+def get_allowed_origins():
+    return allowed_origins.get()
+
+
 def validate_allowed_origin(uri, origin_match=False):
     if uri is None or uri == '':
         return False
-    try:
-        AllowedOrigin.objects.get(key=generate_origin(uri))
-    except AllowedOrigin.DoesNotExist:
-        return False
-    return True
+    return generate_origin(uri) in get_allowed_origins()
 
 
 class CustomDatabaseWhitelistCorsMiddleware(CorsMiddleware):
@@ -1,12 +1,33 @@
 # Generated by Django 2.1.11 on 2019-09-02 13:05
 
 from django.db import migrations
+from oauth2_provider.models import get_application_model
+from oidc_provider.models import Client
 
-from users.signals import generate_and_save_allowed_origins_from_client_configurations
+from users.models import AllowedOrigin
+from users.utils import generate_origin
+
+
+def _process_uris(uris):
+    if isinstance(uris, list):
+        return uris
+    return uris.splitlines()
 
 
 def populate_allowed_origin(apps, schema_editor):
-    generate_and_save_allowed_origins_from_client_configurations(None, None)
+    # The allowed origins are maintained incrementally nowadays, so this
+    # keeps the original full-table population that was run at this point.
+    uri_texts = list()
+    for manager in [get_application_model().objects, Client.objects]:
+        for obj in manager.all():
+            for field in ['redirect_uris', 'post_logout_redirect_uris']:
+                value = getattr(obj, field, None)
+                if value is None or len(value) == 0:
+                    continue
+                uri_texts.append(value)
+
+    valid_origins = set((generate_origin(u) for uri_text in uri_texts for u in _process_uris(uri_text)))
+    AllowedOrigin.objects.bulk_create((AllowedOrigin(key=key) for key in valid_origins))
 
 
 def _noop(apps, schema_editor):
@@ -0,0 +1,68 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+from users.utils import generate_origin
+
+
+def _get_origins(obj, fields):
+    origins = set()
+    for field in fields:
+        value = getattr(obj, field, None)
+        if not value:
+            continue
+        origins.update(generate_origin(uri) for uri in value.splitlines())
+    origins.discard(None)
+    return origins
+
+
+def populate_allowed_origin_clients(apps, schema_editor):
+    AllowedOrigin = apps.get_model('users', 'AllowedOrigin')
+    AllowedOriginClient = apps.get_model('users', 'AllowedOriginClient')
+    Application = apps.get_model('users', 'Application')
+    Client = apps.get_model('oidc_provider', 'Client')
+
+    # Historical models don't have the list properties of oidc_provider's Client
+    sources = [
+        ('application', Application, ['redirect_uris', 'post_logout_redirect_uris']),
+        ('oidc_client', Client, ['_redirect_uris', '_post_logout_redirect_uris']),
+    ]
+    references = set()
+    for client_type, model, fields in sources:
+        for obj in model.objects.all():
+            references.update((origin, client_type, obj.pk) for origin in _get_origins(obj, fields))
+
+    AllowedOrigin.objects.all().delete()
+    AllowedOrigin.objects.bulk_create(AllowedOrigin(key=key) for key in {ref[0] for ref in references})
+    AllowedOriginClient.objects.bulk_create(
+        AllowedOriginClient(origin_id=origin, client_type=client_type, client_pk=client_pk)
+        for origin, client_type, client_pk in references
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oidc_provider', '0026_client_multiple_response_types'),
+        ('users', '0023_add_login_method_disabled_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllowedOriginClient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_type', models.CharField(
+                    choices=[('application', 'OAuth2 application'), ('oidc_client', 'OIDC client')], max_length=20
+                )),
+                ('client_pk', models.BigIntegerField()),
+                ('origin', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='clients', to='users.AllowedOrigin'
+                )),
+            ],
+            options={
+                'unique_together': {('origin', 'client_type', 'client_pk')},
+                'index_together': {('client_type', 'client_pk')},
+            },
+        ),
+        migrations.RunPython(populate_allowed_origin_clients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0024_allowedoriginclient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(verbose_name='timestamp')),
+                ('event', models.CharField(db_index=True, max_length=64, verbose_name='event')),
+                ('message', models.TextField(verbose_name='message')),
+                ('user_uuid', models.UUIDField(blank=True, db_index=True, null=True, verbose_name='user UUID')),
+                ('user_identifier', models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='user identifier')),
+                ('user_ip', models.CharField(blank=True, max_length=50, null=True, verbose_name='user IP address')),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'audit event',
+                'verbose_name_plural': 'audit events',
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='auditevent',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='users_auditevent_ts_brin'),
+        ),
+    ]
@@ -4,6 +4,7 @@ import logging
 import uuid
 
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
@@ -113,7 +114,38 @@ class AllowedOrigin(models.Model):
     key = models.CharField(max_length=300, null=False, primary_key=True)
 
 
+class AllowedOriginClient(models.Model):
+    """A reference from an allowed origin to a client configuration using it.
+
+    An AllowedOrigin is kept as long as at least one client references it.
+    """
+    CLIENT_TYPE_APPLICATION = 'application'
+    CLIENT_TYPE_OIDC_CLIENT = 'oidc_client'
+    CLIENT_TYPES = (
+        (CLIENT_TYPE_APPLICATION, 'OAuth2 application'),
+        (CLIENT_TYPE_OIDC_CLIENT, 'OIDC client'),
+    )
+
+    origin = models.ForeignKey(AllowedOrigin, related_name='clients', on_delete=models.CASCADE)
+    client_type = models.CharField(max_length=20, choices=CLIENT_TYPES)
+    client_pk = models.BigIntegerField()
+
+    class Meta:
+        unique_together = [('origin', 'client_type', 'client_pk')]
+        index_together = [('client_type', 'client_pk')]
+
+
 class UserLoginEntryManager(models.Manager):
+    @staticmethod
+    def get_geo_location(ip_address):
+        try:
+            return get_geo_location_data_for_ip(ip_address)
+        except Exception as e:
+            # catch all exceptions here because we don't want any geo location related error
+            # to make the whole login entry creation fail.
+            logger.exception('Error getting geo location data for an IP: {}'.format(e))
+            return None
+
     def create_from_request(self, request, service, **kwargs):
         kwargs.setdefault('user', request.user)
 
@@ -121,12 +153,7 @@ class UserLoginEntryManager(models.Manager):
             kwargs['ip_address'] = get_client_ip(request)[0]
 
         if 'geo_location' not in kwargs:
-            try:
-                kwargs['geo_location'] = get_geo_location_data_for_ip(kwargs['ip_address'])
-            except Exception as e:
-                # catch all exceptions here because we don't want any geo location related error
-                # to make the whole login entry creation fail.
-                logger.exception('Error getting geo location data for an IP: {}'.format(e))
+            kwargs['geo_location'] = self.get_geo_location(kwargs['ip_address'])
 
         return self.create(service=service, **kwargs)
 
@@ -151,3 +178,29 @@ class UserLoginEntry(models.Model):
         if not self.timestamp:
             self.timestamp = now()
         super().save(*args, **kwargs)
+
+
+class AuditEvent(models.Model):
+    """
+    An event of the audit log.
+
+    Events are only ever appended, so the timestamp follows the physical row
+    order and a BRIN index is enough for time range queries.
+    """
+    timestamp = models.DateTimeField(verbose_name=_('timestamp'))
+    event = models.CharField(verbose_name=_('event'), max_length=64, db_index=True)
+    message = models.TextField(verbose_name=_('message'))
+    user_uuid = models.UUIDField(verbose_name=_('user UUID'), null=True, blank=True, db_index=True)
+    user_identifier = models.CharField(
+        verbose_name=_('user identifier'), max_length=255, null=True, blank=True, db_index=True
+    )
+    user_ip = models.CharField(verbose_name=_('user IP address'), max_length=50, null=True, blank=True)
+    data = JSONField(verbose_name=_('data'), default=dict, blank=True)
+
+    class Meta:
+        verbose_name = _('audit event')
+        verbose_name_plural = _('audit events')
+        ordering = ('-id',)
+        indexes = [
+            BrinIndex(fields=['timestamp'], name='users_auditevent_ts_brin'),
+        ]
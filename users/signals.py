@@ -1,12 +1,17 @@
 from crequest.middleware import CrequestMiddleware
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from oauth2_provider.models import AccessToken, get_application_model
 from oidc_provider.models import Client, Token
 
 from services.models import Service
-from users.models import AllowedOrigin, Application, UserLoginEntry
-from users.utils import generate_origin
+from tunnistamo.api_common import invalidate_cached_token
+from tunnistamo.auditlog import client_names
+from users.login_entries import record_login_entry
+from users.middleware import invalidate_allowed_origins
+from users.models import AllowedOrigin, AllowedOriginClient, Application
+from users.utils import generate_origin, post_logout_redirect_uris
 
 
 @receiver(post_save, sender=AccessToken)
@@ -21,7 +26,7 @@ def handle_oauth2_access_token_save(sender, instance, **kwargs):
     except Service.DoesNotExist:
         return
 
-    UserLoginEntry.objects.create_from_request(request, service, user=instance.user)
+    record_login_entry(request, service, instance.user)
 
 
 @receiver(post_save, sender=Token)
@@ -36,7 +41,13 @@ def handle_oidc_token_save(sender, instance, **kwargs):
     except Service.DoesNotExist:
         return
 
-    UserLoginEntry.objects.create_from_request(request, service, user=instance.user)
+    record_login_entry(request, service, instance.user)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_oidc_token_cache(sender, instance, **kwargs):
+    invalidate_cached_token(instance.access_token)
 
 
 # FIXME: create consistent API for both Client and Application models
@@ -46,27 +57,123 @@ def _process_uris(uris):
     return uris.splitlines()
 
 
-def generate_and_save_allowed_origins_from_client_configurations(sender, instance, **kwargs):
+def _get_client_type(instance):
+    if isinstance(instance, Client):
+        return AllowedOriginClient.CLIENT_TYPE_OIDC_CLIENT
+    return AllowedOriginClient.CLIENT_TYPE_APPLICATION
+
+
+def _get_client_origins(obj):
     uri_texts = list()
+    for field in ['redirect_uris', 'post_logout_redirect_uris']:
+        value = getattr(obj, field, None)
+        if value is None or len(value) == 0:
+            continue
+        uri_texts.append(value)
+
+    origins = set((generate_origin(u) for uri_text in uri_texts for u in _process_uris(uri_text)))
+    origins.discard(None)
+    return origins
+
+
+def _lock_allowed_origins(keys):
+    """Lock the existing allowed origins with the given keys. Returns the keys of the locked origins."""
+    origins = AllowedOrigin.objects.select_for_update().filter(key__in=keys).order_by('key')
+    return set(origins.values_list('key', flat=True))
+
+
+def rebuild_allowed_origins():
+    """Regenerate all allowed origins and their client references from scratch."""
+    references = set()
     for manager in [get_application_model().objects, Client.objects]:
         for obj in manager.all():
-            for field in ['redirect_uris', 'post_logout_redirect_uris']:
-                value = getattr(obj, field, None)
-                if value is None or len(value) == 0:
-                    continue
-                uri_texts.append(value)
+            client_type = _get_client_type(obj)
+            references.update((origin, client_type, obj.pk) for origin in _get_client_origins(obj))
 
-    valid_origins = set((generate_origin(u) for uri_text in uri_texts for u in _process_uris(uri_text)))
-    persisted_origins = set(AllowedOrigin.objects.values_list('key', flat=True))
+    with transaction.atomic():
+        AllowedOrigin.objects.all().delete()
+        AllowedOrigin.objects.bulk_create((AllowedOrigin(key=key) for key in {ref[0] for ref in references}))
+        AllowedOriginClient.objects.bulk_create((
+            AllowedOriginClient(origin_id=origin, client_type=client_type, client_pk=client_pk)
+            for origin, client_type, client_pk in references
+        ))
 
-    origins_to_add = valid_origins - persisted_origins
-    origins_to_delete = persisted_origins - valid_origins
+    invalidate_allowed_origins()
 
-    AllowedOrigin.objects.filter(key__in=origins_to_delete).delete()
-    AllowedOrigin.objects.bulk_create((AllowedOrigin(key=key) for key in origins_to_add))
+
+def generate_and_save_allowed_origins_from_client_configurations(sender, instance, **kwargs):
+    """Update the allowed origins referenced by a saved or deleted client.
+
+    Only the origins of the changed instance are compared against its
+    existing references. An origin is removed when no client references it
+    anymore. If no instance is given, everything is rebuilt.
+    """
+    if instance is None:
+        rebuild_allowed_origins()
+        return
+
+    if kwargs.get('signal') is post_delete:
+        valid_origins = set()
+    else:
+        valid_origins = _get_client_origins(instance)
+
+    with transaction.atomic():
+        references = AllowedOriginClient.objects.filter(client_type=_get_client_type(instance), client_pk=instance.pk)
+        persisted_origins = set(references.values_list('origin_id', flat=True))
+
+        origins_to_add = valid_origins - persisted_origins
+        origins_to_delete = persisted_origins - valid_origins
+
+        if origins_to_add:
+            AllowedOrigin.objects.bulk_create(
+                (AllowedOrigin(key=key) for key in origins_to_add), ignore_conflicts=True
+            )
+
+        if origins_to_add or origins_to_delete:
+            # Concurrent updates of the same origins are serialized, so that
+            # an origin isn't deleted as unreferenced while another client
+            # is adding a reference to it
+            locked_origins = _lock_allowed_origins(origins_to_add | origins_to_delete)
+            # Deleted by a concurrent update after the conflicting insert above
+            missing_origins = origins_to_add - locked_origins
+            if missing_origins:
+                AllowedOrigin.objects.bulk_create(
+                    (AllowedOrigin(key=key) for key in missing_origins), ignore_conflicts=True
+                )
+
+        if origins_to_delete:
+            references.filter(origin_id__in=origins_to_delete).delete()
+            AllowedOrigin.objects.filter(key__in=origins_to_delete, clients__isnull=True).delete()
+
+        if origins_to_add:
+            AllowedOriginClient.objects.bulk_create((
+                AllowedOriginClient(origin_id=key, client_type=_get_client_type(instance), client_pk=instance.pk)
+                for key in origins_to_add
+            ))
+
+    if origins_to_add or origins_to_delete:
+        invalidate_allowed_origins()
 
 
 post_save.connect(generate_and_save_allowed_origins_from_client_configurations, sender=Application)
 post_save.connect(generate_and_save_allowed_origins_from_client_configurations, sender=Client)
 post_delete.connect(generate_and_save_allowed_origins_from_client_configurations, sender=Application)
 post_delete.connect(generate_and_save_allowed_origins_from_client_configurations, sender=Client)
+
+
+def invalidate_post_logout_redirect_uris(sender, instance, **kwargs):
+    post_logout_redirect_uris.invalidate()
+
+
+post_save.connect(invalidate_post_logout_redirect_uris, sender=Application)
+post_save.connect(invalidate_post_logout_redirect_uris, sender=Client)
+post_delete.connect(invalidate_post_logout_redirect_uris, sender=Application)
+post_delete.connect(invalidate_post_logout_redirect_uris, sender=Client)
+
+
+def invalidate_client_names(sender, instance, **kwargs):
+    client_names.invalidate()
+
+
+post_save.connect(invalidate_client_names, sender=Client)
+post_delete.connect(invalidate_client_names, sender=Client)
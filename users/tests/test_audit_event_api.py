@@ -0,0 +1,103 @@
+import logging
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils.timezone import now
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from tunnistamo.audit_logging import DatabaseHandler
+from users.factories import UserFactory, access_token_factory
+from users.models import AuditEvent
+
+LIST_URL = reverse('v1:auditevent-list')
+
+
+@pytest.fixture(autouse=True)
+def auto_mark_django_db(db):
+    pass
+
+
+@pytest.fixture
+def admin_api_client():
+    api_client = APIClient()
+    api_client.force_authenticate(UserFactory(is_staff=True))
+    return api_client
+
+
+def create_event(event='authentication_failure', **kwargs):
+    kwargs.setdefault('timestamp', now())
+    return AuditEvent.objects.create(event=event, message='Test event', **kwargs)
+
+
+def test_get_requires_admin_user():
+    api_client = APIClient()
+    api_client.force_authenticate(UserFactory())
+    response = api_client.get(LIST_URL)
+    assert response.status_code == 403
+
+
+def test_get_not_allowed_with_access_token():
+    token = access_token_factory(user=UserFactory(is_staff=True), scopes=['openid'])
+    api_client = APIClient()
+    api_client.credentials(HTTP_AUTHORIZATION='Bearer {}'.format(token.access_token))
+
+    response = api_client.get(LIST_URL)
+    assert response.status_code == 403
+
+
+def test_keyset_pagination(admin_api_client):
+    events = [create_event() for i in range(3)]
+
+    response = admin_api_client.get(LIST_URL, {'limit': 2})
+    assert response.status_code == 200
+    assert [e['id'] for e in response.data['results']] == [events[2].id, events[1].id]
+
+    response = admin_api_client.get(response.data['next'])
+    assert [e['id'] for e in response.data['results']] == [events[0].id]
+    assert response.data['next'] is None
+
+
+def test_filter_by_user_identifier_and_time(admin_api_client):
+    create_event(user_identifier='12345', timestamp=now() - timedelta(hours=2))
+    recent = create_event(user_identifier='12345')
+    create_event(user_identifier='54321')
+
+    response = admin_api_client.get(LIST_URL, {
+        'user_identifier': '12345',
+        'since': (now() - timedelta(hours=1)).isoformat(),
+    })
+    assert [e['id'] for e in response.data['results']] == [recent.id]
+
+
+def test_database_handler_saves_context():
+    record = logging.LogRecord('tunnistamo.audit', logging.INFO, __file__, 1, 'Login failed', None, None)
+    record.__dict__.update(event='authentication_failure', user_identifier='12345', backend='koha')
+
+    DatabaseHandler().emit_batch([record])
+
+    event = AuditEvent.objects.get()
+    assert event.event == 'authentication_failure'
+    assert event.user_identifier == '12345'
+    assert event.data == {'backend': 'koha'}
+
+
+def test_delete_expired_audit_events():
+    create_event(timestamp=now() - timedelta(days=40))
+    create_event(timestamp=now() - timedelta(days=35))
+    recent = create_event(timestamp=now() - timedelta(days=1))
+
+    call_command('delete_expired_audit_events', days=30, batch_size=1)
+
+    assert list(AuditEvent.objects.values_list('id', flat=True)) == [recent.id]
+
+
+def test_delete_expired_audit_events_keeps_recent_events_between_expired_ids():
+    create_event(timestamp=now() - timedelta(days=40))
+    recent = create_event(timestamp=now() - timedelta(days=1))
+    create_event(timestamp=now() - timedelta(days=35))
+
+    call_command('delete_expired_audit_events', days=30)
+
+    assert list(AuditEvent.objects.values_list('id', flat=True)) == [recent.id]
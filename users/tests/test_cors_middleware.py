@@ -1,8 +1,11 @@
 import itertools
+from unittest import mock
 
 import pytest
 
+from users import signals
 from users.factories import access_token_factory
+from users.middleware import validate_allowed_origin
 from users.models import AllowedOrigin
 
 
@@ -135,3 +138,38 @@ def test_cors_headers_got_with_whitelisted_uris_apiendpoints(
 
     for origin in get_origins(0, len(urls)):
         assert_cors_not_found(origin, get_response('origin'))
+
+
+@pytest.mark.django_db
+def test_allowed_origins_are_loaded_once_per_version(application_factory, django_assert_num_queries):
+    application_factory(redirect_uris='https://allowed.example.com/callback')
+
+    assert validate_allowed_origin('https://allowed.example.com/foo')
+
+    with django_assert_num_queries(0):
+        assert validate_allowed_origin('https://allowed.example.com/bar')
+        assert not validate_allowed_origin('https://other.example.com/')
+
+    application_factory(redirect_uris='https://other.example.com/callback')
+
+    assert validate_allowed_origin('https://other.example.com/')
+
+
+@pytest.mark.django_db
+def test_origin_deleted_by_concurrent_update_is_created_again(application_factory):
+    application = application_factory(redirect_uris='https://shared.example.com/callback')
+    lock_allowed_origins = signals._lock_allowed_origins
+    concurrent_updates = [application.delete]
+
+    def lock_after_concurrent_delete(keys):
+        # The other client dropped the origin and committed while this
+        # update was waiting for the lock
+        while concurrent_updates:
+            concurrent_updates.pop()()
+        return lock_allowed_origins(keys)
+
+    with mock.patch('users.signals._lock_allowed_origins', side_effect=lock_after_concurrent_delete):
+        application_factory(redirect_uris='https://shared.example.com/other-callback')
+
+    assert AllowedOrigin.objects.filter(key='https://shared.example.com').exists()
+    assert validate_allowed_origin('https://shared.example.com/')
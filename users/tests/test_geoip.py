@@ -0,0 +1,94 @@
+from unittest import mock
+
+import pytest
+from geoip2.errors import AddressNotFoundError
+
+from users.utils import GEOIP_RELOAD_CHECK_INTERVAL, GeoIPReader, get_geo_location_data_for_ip
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000
+        self.mtime = 1
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    clock = Clock()
+    with mock.patch('users.utils.time.monotonic', side_effect=lambda: clock.now), \
+            mock.patch('users.utils.os.stat', side_effect=lambda path: mock.Mock(st_mtime=clock.mtime)):
+        yield clock
+
+
+@pytest.fixture
+def geoip2():
+    def create_geoip(**kwargs):
+        geoip = mock.Mock(_city_file='/geoip/GeoLite2-City.mmdb')
+        geoip.city.side_effect = lambda ip_address: {'ip_address': ip_address}
+        return geoip
+
+    with mock.patch('users.utils.GeoIP2') as geoip2:
+        geoip2.side_effect = create_geoip
+        yield geoip2
+
+
+def test_repeated_lookups_are_served_from_memory(geoip2, clock):
+    reader = GeoIPReader()
+
+    assert reader.city('1.2.3.4') == {'ip_address': '1.2.3.4'}
+    assert reader.city('1.2.3.4') == {'ip_address': '1.2.3.4'}
+    reader.city('5.6.7.8')
+
+    assert [c[0][0] for c in reader._geoip.city.call_args_list] == ['1.2.3.4', '5.6.7.8']
+
+
+def test_database_is_reopened_when_file_changes(geoip2, clock):
+    reader = GeoIPReader()
+    reader.city('1.2.3.4')
+
+    # The file is checked only once in a while
+    clock.mtime = 2
+    clock.advance(GEOIP_RELOAD_CHECK_INTERVAL - 1)
+    reader.city('1.2.3.4')
+    assert geoip2.call_count == 1
+
+    clock.advance(1)
+    reader.city('1.2.3.4')
+    assert geoip2.call_count == 2
+    # Lookups of the old database are discarded
+    assert reader._geoip.city.call_count == 1
+
+
+def test_database_is_not_reopened_when_file_is_unchanged(geoip2, clock):
+    reader = GeoIPReader()
+    reader.city('1.2.3.4')
+
+    clock.advance(GEOIP_RELOAD_CHECK_INTERVAL)
+    reader.city('1.2.3.4')
+
+    assert geoip2.call_count == 1
+    assert reader._geoip.city.call_count == 1
+
+
+def test_unknown_address(geoip2, clock, settings):
+    settings.GEOIP_PATH = '/geoip'
+    reader = GeoIPReader()
+    reader._get_geoip()
+    reader._geoip.city.side_effect = AddressNotFoundError('Address not found')
+
+    with mock.patch('users.utils.geoip_reader', reader):
+        assert get_geo_location_data_for_ip('1.2.3.4') is None
+        assert get_geo_location_data_for_ip('1.2.3.4') is None
+
+    assert reader._geoip.city.call_count == 1
+
+
+def test_no_geoip_database(geoip2, settings):
+    if hasattr(settings, 'GEOIP_PATH'):
+        del settings.GEOIP_PATH
+
+    assert get_geo_location_data_for_ip('1.2.3.4') is None
+    assert not geoip2.called
@@ -0,0 +1,125 @@
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.utils.timezone import now
+
+from users.factories import UserFactory
+from users.login_entries import LoginEntryBuffer, record_login_entry
+from users.models import UserLoginEntry
+
+
+@pytest.fixture
+def login_entry_buffer():
+    with mock.patch.object(LoginEntryBuffer, '_ensure_writer'):
+        yield LoginEntryBuffer(max_size=2, batch_size=1)
+
+
+def make_entry(user, service):
+    return UserLoginEntry(user_id=user.pk, service_id=service.pk, timestamp=now(), ip_address='1.2.3.4')
+
+
+@pytest.mark.django_db
+def test_buffered_entries_are_written_on_flush(login_entry_buffer, service):
+    user = UserFactory()
+    assert login_entry_buffer.put(make_entry(user, service))
+    assert login_entry_buffer.put(make_entry(user, service))
+    assert UserLoginEntry.objects.count() == 0
+
+    assert login_entry_buffer.flush() == 2
+
+    assert UserLoginEntry.objects.filter(user=user, service=service, ip_address='1.2.3.4').count() == 2
+    assert login_entry_buffer.get_stats() == {
+        'enqueued': 2, 'dropped': 0, 'written': 2, 'failed': 0, 'buffered': 0,
+    }
+
+
+@pytest.mark.django_db
+def test_entries_are_dropped_when_buffer_is_full(login_entry_buffer, service):
+    user = UserFactory()
+    for i in range(3):
+        login_entry_buffer.put(make_entry(user, service))
+
+    assert login_entry_buffer.get_stats()['dropped'] == 1
+    assert login_entry_buffer.flush() == 2
+
+
+@pytest.mark.django_db
+def test_failing_entry_does_not_drop_batch(service):
+    # Check the foreign keys already when the entries are inserted, like they
+    # are when the writer commits
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    login_entry_buffer = LoginEntryBuffer(batch_size=3)
+    user = UserFactory()
+    deleted_user = UserFactory()
+    entries = [make_entry(user, service), make_entry(deleted_user, service), make_entry(user, service)]
+    deleted_user.delete()
+    with mock.patch.object(LoginEntryBuffer, '_ensure_writer'):
+        for entry in entries:
+            login_entry_buffer.put(entry)
+
+    assert login_entry_buffer.flush() == 2
+
+    assert UserLoginEntry.objects.filter(user=user).count() == 2
+    assert login_entry_buffer.get_stats()['written'] == 2
+    assert login_entry_buffer.get_stats()['failed'] == 1
+
+
+@pytest.fixture
+def async_login_entries(settings, login_entry_buffer):
+    settings.USER_LOGIN_ENTRY_ASYNC = True
+    with mock.patch('users.login_entries.login_entry_buffer', login_entry_buffer):
+        yield login_entry_buffer
+
+
+@pytest.fixture
+def on_commit_callbacks():
+    callbacks = []
+    with mock.patch('users.login_entries.transaction.on_commit', side_effect=callbacks.append):
+        yield callbacks
+
+
+@pytest.mark.django_db
+def test_async_login_entry_is_buffered_on_commit(async_login_entries, on_commit_callbacks, rf, service):
+    user = UserFactory()
+
+    record_login_entry(rf.get('/'), service, user)
+    assert async_login_entries.get_stats()['buffered'] == 0
+
+    for callback in on_commit_callbacks:
+        callback()
+    assert async_login_entries.get_stats()['buffered'] == 1
+    assert UserLoginEntry.objects.count() == 0
+
+    assert async_login_entries.flush() == 1
+    assert UserLoginEntry.objects.filter(user=user, service=service).count() == 1
+
+
+@pytest.mark.django_db
+def test_async_login_entries_are_dropped_when_buffer_is_full(async_login_entries, on_commit_callbacks, rf, service):
+    user = UserFactory()
+    for i in range(3):
+        record_login_entry(rf.get('/'), service, user)
+    for callback in on_commit_callbacks:
+        callback()
+
+    assert async_login_entries.get_stats()['dropped'] == 1
+    assert async_login_entries.flush() == 2
+
+
+@mock.patch('users.login_entries.logger')
+def test_stats_are_logged_periodically(logger, login_entry_buffer):
+    login_entry_buffer.stats_log_interval = 60
+    logged_at = login_entry_buffer._stats_logged_at
+
+    with mock.patch('users.login_entries.time.monotonic', return_value=logged_at + 59):
+        login_entry_buffer._log_stats_if_due()
+    assert not logger.info.called
+
+    with mock.patch('users.login_entries.time.monotonic', return_value=logged_at + 60):
+        login_entry_buffer._log_stats_if_due()
+    assert logger.info.call_count == 1
+    assert logger.info.call_args[0][1] == {
+        'enqueued': 0, 'dropped': 0, 'written': 0, 'failed': 0, 'buffered': 0,
+    }
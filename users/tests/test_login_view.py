@@ -3,6 +3,8 @@ from django.urls import reverse
 from django.utils.crypto import get_random_string
 from django.utils.http import urlquote
 
+from tunnistamo.circuit_breaker import get_breaker
+
 
 @pytest.mark.django_db
 def test_login_view_next_url(client, assertCountEqual, loginmethod_factory, application_factory):
@@ -137,3 +139,27 @@ def test_login_view_loginmethods_per_oidcclient(client, assertCountEqual, loginm
     response = client.get('/login/', params)
 
     assertCountEqual(response.context['login_methods'], login_methods)
+
+
+@pytest.mark.django_db
+def test_login_view_marks_loginmethod_with_open_circuit_unavailable(client, loginmethod_factory):
+    loginmethod_factory(provider_id='koha')
+    loginmethod_factory(provider_id='github')
+    get_breaker('koha').open()
+
+    response = client.get('/login/')
+
+    assert response.status_code == 200
+    unavailable = {m.provider_id: m.temporarily_unavailable for m in response.context['login_methods']}
+    assert unavailable == {'koha': True, 'github': False}
+    assert 'Authentication method temporarily unavailable.' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_login_view_no_redirect_to_unavailable_loginmethod(client, loginmethod_factory):
+    loginmethod_factory(provider_id='koha')
+    get_breaker('koha').open()
+
+    response = client.get('/login/')
+
+    assert response.status_code == 200
@@ -76,3 +76,16 @@ def test_logout_redirect_next_authenticated(client, user_factory, application_fa
 
     assert response.status_code == 302
     assert response['location'] == params['next']
+
+
+@pytest.mark.django_db
+def test_logout_redirect_uri_lookup_does_not_scan_clients(client, application_factory, django_assert_num_queries):
+    application_factory(post_logout_redirect_uris='http://example.com/', redirect_uris=['http://example.com/'])
+
+    assert client.get('/logout/', {'next': 'http://example.com/'}).status_code == 302
+
+    # The redirect URIs are served from memory once loaded
+    with django_assert_num_queries(0):
+        response = client.get('/logout/', {'next': 'http://example.com/'})
+
+    assert response.status_code == 302
@@ -3,6 +3,7 @@ from django.urls import reverse
 from oidc_provider.models import UserConsent
 
 from oidc_apis.factories import ApiFactory, ApiScopeFactory
+from oidc_apis.models import ApiScope
 from users.factories import OIDCClientFactory, UserFactory
 from users.views import TunnistamoOidcAuthorizeView
 
@@ -86,3 +87,21 @@ def test_api_scopes_are_added_to_user_consent_after_authorization(client, api_sc
     assert response.status_code == 302
     user_consent = UserConsent.objects.get(user=user, client=oidc_client)
     assert 'github_username' in user_consent.scope
+
+
+@pytest.mark.django_db
+def test_api_scope_extension_is_served_from_memory(django_assert_num_queries):
+    api = ApiFactory(required_scopes=['github_username'])
+    api_scope = ApiScopeFactory(api=api)
+
+    assert ApiScope.extend_scope([api_scope.identifier]) == [api_scope.identifier, 'github_username']
+
+    with django_assert_num_queries(0):
+        assert ApiScope.extend_scope(['openid', api_scope.identifier]) == [
+            'openid', api_scope.identifier, 'github_username'
+        ]
+
+    api.required_scopes = ['email']
+    api.save()
+
+    assert ApiScope.extend_scope([api_scope.identifier]) == [api_scope.identifier, 'email']
@@ -1,21 +1,75 @@
+import functools
+import os
+import threading
+import time
 from urllib.parse import urlparse
 
 from django.conf import settings
 from django.contrib.gis.geoip2 import GeoIP2
 from geoip2.errors import AddressNotFoundError
 
+from tunnistamo.utils import VersionedValue
+
+GEOIP_LOOKUP_CACHE_SIZE = 4096
+# How often (in seconds) the database file is checked for changes
+GEOIP_RELOAD_CHECK_INTERVAL = 60
+
+
+class GeoIPReader:
+    """A process-wide memory-mapped GeoIP2 reader with memoized city lookups.
+
+    The database is reopened and the memoized lookups discarded when the
+    modification time of the city database file changes.
+    """
+
+    def __init__(self, cache_size=GEOIP_LOOKUP_CACHE_SIZE):
+        self._geoip = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._lookup_city = functools.lru_cache(maxsize=cache_size)(self._city)
+
+    @staticmethod
+    def _get_mtime(geoip):
+        city_file = getattr(geoip, '_city_file', None)
+        try:
+            return os.path.getmtime(city_file) if city_file else None
+        except OSError:
+            return None
+
+    def _get_geoip(self):
+        if self._geoip is not None and time.monotonic() - self._checked_at < GEOIP_RELOAD_CHECK_INTERVAL:
+            return self._geoip
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._geoip is None or self._get_mtime(self._geoip) != self._mtime:
+                # The previous reader closes its files when garbage collected
+                self._geoip = GeoIP2(cache=GeoIP2.MODE_MMAP)
+                self._mtime = self._get_mtime(self._geoip)
+                self._lookup_city.cache_clear()
+
+        return self._geoip
+
+    def _city(self, ip_address):
+        try:
+            return self._geoip.city(ip_address)
+        except AddressNotFoundError:
+            return None
+
+    def city(self, ip_address):
+        self._get_geoip()
+        return self._lookup_city(ip_address)
+
+
+geoip_reader = GeoIPReader()
+
 
 def get_geo_location_data_for_ip(ip_address):
     if not hasattr(settings, 'GEOIP_PATH'):
         return None
 
-    g = GeoIP2()
-    try:
-        location = g.city(ip_address)
-    except AddressNotFoundError:
-        location = None
-
-    return location
+    return geoip_reader.city(ip_address)
 
 
 def generate_origin(uri):
@@ -27,3 +81,20 @@ def generate_origin(uri):
         return "{}://{}".format(parsed.scheme, parsed.netloc)
     except ValueError:
         return None
+
+
+def _load_post_logout_redirect_uris():
+    from oidc_provider.models import Client
+    from users.models import Application
+
+    uris = set()
+    for value in Application.objects.values_list('post_logout_redirect_uris', flat=True):
+        uris.update(value.splitlines())
+    for value in Client.objects.values_list('_post_logout_redirect_uris', flat=True):
+        uris.update(value.splitlines())
+    return frozenset(uris)
+
+
+# All post logout redirect URIs configured for any OAuth2 application or
+# OIDC client. Invalidated by the client signal handlers.
+post_logout_redirect_uris = VersionedValue('post-logout-redirect-uris-version', _load_post_logout_redirect_uris)
@@ -24,9 +24,11 @@ from social_django.models import UserSocialAuth
 from social_django.utils import load_backend, load_strategy
 
 from tunnistamo import auditlog
+from tunnistamo.circuit_breaker import get_breaker
 from oidc_apis.models import ApiScope
 
 from .models import LoginMethod, OidcClientOptions
+from .utils import post_logout_redirect_uris
 
 
 # This is used to pass the request query dict to the OIDC endpoint
@@ -84,6 +86,10 @@ class LoginView(TemplateView):
                 begin_url += '?' + urlencode(url_params)
 
             m.login_url = begin_url
+            # Backends calling an upstream service are shown as unavailable
+            # while the circuit breaker of the service is open
+            upstream = getattr(backend, 'upstream', None)
+            m.temporarily_unavailable = upstream is not None and not get_breaker(upstream).is_available()
             methods.append(m)
 
         return methods
@@ -143,7 +149,7 @@ class LoginView(TemplateView):
 
         login_methods = self.get_login_methods(request, allowed_methods, next_url)
 
-        if len(login_methods) == 1:
+        if len(login_methods) == 1 and not login_methods[0].temporarily_unavailable:
             return redirect(login_methods[0].login_url)
 
         self.login_methods = login_methods
@@ -156,12 +162,6 @@ class LoginView(TemplateView):
         return context
 
 
-def _process_uris(uris):
-    if isinstance(uris, list):
-        return uris
-    return uris.splitlines()
-
-
 def create_logout_response(request, user, backend_name, redirect_uri):
     backend = load_backend(load_strategy(request), backend_name, redirect_uri=None)
 
@@ -187,20 +187,13 @@ class LogoutView(TemplateView):
         several URIs.
 
         This method treats all URIs of all OAuth apps and OIDC Clients
-        as valid for any logout request.
+        as valid for any logout request. The URIs are looked up from a
+        precomputed set which is refreshed whenever a client changes.
         """
         if uri is None or uri == '':
             return False
 
-        uri_texts = list()
-        for manager in [get_application_model().objects, Client.objects]:
-            for o in manager.all():
-                value = o.post_logout_redirect_uris
-                if value is None or len(value) == 0:
-                    continue
-                uri_texts.append(value)
-
-        return uri in (u for uri_text in uri_texts for u in _process_uris(uri_text))
+        return uri in post_logout_redirect_uris.get()
 
     def get(self, *args, **kwargs):
         user = self.request.user
@@ -211,24 +204,17 @@ class LogoutView(TemplateView):
         if self.request.user.is_authenticated:
             auth_logout(self.request)
 
-        uri = self.request.GET.get('next')
-        if self._validate_client_uri(uri):
-            return redirect(uri)
-
         redirect_uri = self.request.GET.get('next')
-        if redirect_uri and not self._validate_client_uri(redirect_uri):
-            redirect_uri = None
+        if self._validate_client_uri(redirect_uri):
+            return redirect(redirect_uri)
 
         if backend_name:
             logout_response = create_logout_response(
-                self.request, user, backend_name, redirect_uri
+                self.request, user, backend_name, None
             )
             if logout_response is not None:
                 return logout_response
 
-        if redirect_uri:
-            return redirect(redirect_uri)
-
         return super(LogoutView, self).get(*args, **kwargs)
 
 
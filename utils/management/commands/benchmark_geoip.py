@@ -0,0 +1,39 @@
+import timeit
+
+from django.contrib.gis.geoip2 import GeoIP2
+from django.core.management.base import BaseCommand
+from geoip2.errors import AddressNotFoundError
+
+from users.utils import GeoIPReader
+
+
+class Command(BaseCommand):
+    help = "Benchmark GeoIP lookups with a per-call reader against the shared reader"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-n", "--number", type=int, default=1000, help="Lookups per benchmark")
+        parser.add_argument("ip_addresses", nargs="*", default=["8.8.8.8", "193.166.1.1", "2001:4860:4860::8888"])
+
+    def handle(self, *args, **kwargs):
+        number = kwargs["number"]
+        ip_addresses = kwargs["ip_addresses"]
+
+        def per_call_open(ip_address):
+            try:
+                GeoIP2().city(ip_address)
+            except AddressNotFoundError:
+                pass
+
+        shared_reader = GeoIPReader()
+        uncached_reader = GeoIPReader(cache_size=0)
+
+        benchmarks = [
+            ('GeoIP2() per call', per_call_open),
+            ('shared reader', uncached_reader.city),
+            ('shared reader + LRU', shared_reader.city),
+        ]
+
+        for name, func in benchmarks:
+            elapsed = timeit.timeit(lambda: [func(ip) for ip in ip_addresses], number=number)
+            per_call = elapsed / (number * len(ip_addresses))
+            self.stdout.write("{:<25} {:>10.2f} us/lookup".format(name, per_call * 1e6))
@@ -0,0 +1,46 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from tunnistamo.api_common import (
+    ScopePermission, TokenAuth, _compile_scope_domain_map, get_scope_specifiers, parse_scope
+)
+
+
+class DummyView:
+    required_scopes = ('identities', 'devices', 'login_entries')
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark scope parsing and ScopePermission with large scope sets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-s", "--scopes", type=int, default=500, help="Number of scopes in the token")
+        parser.add_argument("-n", "--number", type=int, default=10000, help="Iterations per benchmark")
+
+    def handle(self, *args, **kwargs):
+        number = kwargs["number"]
+        scopes = ['read:domain{}:specifier{}'.format(i % 50, i) for i in range(kwargs["scopes"])]
+        scopes += list(DummyView.required_scopes)
+
+        request = RequestFactory().get('/')
+        request.auth = TokenAuth(scopes)
+        permission = ScopePermission()
+        view = DummyView()
+
+        def uncached_token_auth():
+            _compile_scope_domain_map.cache_clear()
+            TokenAuth(scopes)
+
+        benchmarks = [
+            ('parse_scope', lambda: [parse_scope(scope) for scope in scopes]),
+            ('TokenAuth (cold)', uncached_token_auth),
+            ('TokenAuth (memoized)', lambda: TokenAuth(scopes)),
+            ('get_scope_specifiers', lambda: get_scope_specifiers(request, 'domain1', 'read')),
+            ('ScopePermission', lambda: permission.has_permission(request, view)),
+        ]
+
+        for name, func in benchmarks:
+            elapsed = timeit.timeit(func, number=number)
+            self.stdout.write("{:<25} {:>10.2f} us/call".format(name, elapsed / number * 1e6))